@@ -1,20 +1,41 @@
-from flask import Flask, request
-import requests
+from flask import Flask, request, jsonify
 import logging
 import os
-import unicodedata
-import string
-import urllib.parse
-from urllib.parse import urlparse, parse_qs 
+import atexit
+import re
+import time
 from datetime import datetime, timedelta
 
-# Librería para la IA
-from huggingface_hub import InferenceClient
+# Cliente de IA (Hugging Face) con presupuesto de latencia
+from cliente_ia import ClienteIA
+from cache_respuestas import CacheRespuestas, huella_contexto
 
 # Firebase
-from conexion_firebase import obtener_productos, db
-import firebase_admin
-from firebase_admin import firestore
+from conexion_firebase import db, obtener_db
+from catalogo import catalogo_compartido
+from estado import crear_backend
+from sesiones import PersistenciaSesiones
+from checkout import crear_pedido_atomico, StockInsuficiente
+from historial_pedidos import ultimo_pedido, historial
+from carrito import Carrito
+
+# Procesamiento asíncrono del webhook
+from cola_eventos import ColaEventos
+from deduplicacion import DeduplicadorEventos
+from envio_facebook import EnviadorFacebook, ENVIO_TASA
+
+# Búsqueda de productos
+from normalizacion import normalizar
+from indice_busqueda import IndiceProductos
+from recuperacion import RecuperadorContexto
+from embeddings import crear_indice_semantico
+from validacion_imagenes import ValidadorImagenes
+
+# Clasificación de mensajes
+from router import Router, reglas_bot
+
+# Precalentamiento en segundo plano y endpoints de salud
+from arranque import Arranque, ARRANQUE_ESPERA_IMAGENES
 
 # ==========================================
 # 1. CONFIGURACIÓN DEL SERVIDOR
@@ -30,140 +51,157 @@ HF_TOKEN = os.environ.get("HF_TOKEN")
 if not PAGE_ACCESS_TOKEN:
     print("❌ ERROR: Faltan credenciales de Facebook en Render.")
 
-# Memoria Caché (RAM)
+# Estado compartido entre workers (memoria local por defecto, Redis con ESTADO_BACKEND=redis)
+def al_desalojar_estado(espacio, clave, valor):
+    # Antes de soltar una sesión de la RAM se asegura su escritura en Firestore
+    if espacio == "sesiones":
+        sesiones.marcar(clave, valor)
+        sesiones.olvidar(clave)
+
+estado_compartido = crear_backend(al_desalojar=al_desalojar_estado)
+
+# Memoria Caché (RAM): sesiones de los usuarios que se están atendiendo en este momento
 user_state = {}
-productos_cache = {
-    "data": None,
-    "timestamp": None,
-    "ttl": 300 
-}
+catalogo = catalogo_compartido(estado=estado_compartido)
 
 # Límites de Seguridad
 RATE_LIMIT_MESSAGES = 10
 RATE_LIMIT_WINDOW = 60
-user_message_count = {} 
+RATE_LIMIT_GLOBAL = int(os.environ.get("RATE_LIMIT_GLOBAL", 100))  # mensajes por segundo entre todos los usuarios
+limitador_mensajes = estado_compartido.limitador("rate_limit", RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW,
+                                                 capacidad_global=RATE_LIMIT_GLOBAL, ventana_global=1)
+
+# Tiempo que una sesión inactiva permanece en el estado compartido
+# (el máximo de sesiones residentes se configura con ESTADO_MAX_CLAVES)
+SESION_TTL = int(os.environ.get("SESION_TTL", 24 * 3600))
+# Con estado compartido, un solo worker a la vez atiende a cada usuario: segundos máximos
+# que se retiene la sesión (por si el worker muere) y que se espera a que la suelte otro
+SESION_LEASE = float(os.environ.get("SESION_LEASE", 30))
+SESION_LEASE_ESPERA = float(os.environ.get("SESION_LEASE_ESPERA", 10))
 
 # ==========================================
 # 2. HERRAMIENTAS Y UTILIDADES
 # ==========================================
-def normalizar(t):
-    if not t: return ""
-    t = t.lower().strip()
-    t = unicodedata.normalize("NFD", t)
-    t = "".join(c for c in t if not unicodedata.combining(c))
-    return t.translate(str.maketrans("", "", string.punctuation))
-
 def verificar_rate_limit(sender_id):
-    global user_message_count
-    ahora = datetime.now()
-    if sender_id not in user_message_count: user_message_count[sender_id] = []
-    user_message_count[sender_id] = [ts for ts in user_message_count[sender_id] if (ahora - ts).total_seconds() < RATE_LIMIT_WINDOW]
-    if len(user_message_count[sender_id]) >= RATE_LIMIT_MESSAGES: return False
-    user_message_count[sender_id].append(ahora)
-    return True
+    return limitador_mensajes.permitir(sender_id)
 
 def sanitizar_input(texto):
     if not texto: return ""
     return texto[:500].replace('<', '').replace('>', '').strip()
 
 # --- VALIDACIÓN DE IMÁGENES ---
-def clean_google_url(url):
-    if not url: return ""
-    clean = url.strip()
-    if "google." in clean and "imgurl=" in clean:
-        try:
-            parsed = urlparse(clean)
-            query_params = parse_qs(parsed.query)
-            if 'imgurl' in query_params:
-                return query_params['imgurl'][0]
-        except: pass
-    return clean
-
-def is_valid_image_url(url, timeout=2):
-    if not url: return False
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (compatible; Bot/1.0)'}
-        r = requests.head(url, headers=headers, allow_redirects=True, timeout=timeout)
-        return r.status_code == 200 and 'image' in r.headers.get('Content-Type', '')
-    except:
-        return False
-
-def get_img_url(datos):
-    raw_url = datos.get("imagen_url", "")
-    nombre_producto = datos.get("nombre", "Producto")
-    clean_url = clean_google_url(raw_url)
-    if clean_url and clean_url.startswith("http") and len(clean_url) > 10:
-        if is_valid_image_url(clean_url):
-            return clean_url
-    nombre_safe = urllib.parse.quote_plus(nombre_producto)
-    return f"https://placehold.co/300x300?text={nombre_safe}"
+validador_imagenes = ValidadorImagenes()
+
+def get_img_url(p):
+    # Solo consulta la caché de validación; nunca hace un HEAD en la petición
+    if p.imagen_url and validador_imagenes.es_valida(p.imagen_url):
+        return p.imagen_url
+    return p.imagen_respaldo
 
 # ==========================================
 # 3. COMUNICACIÓN CON FACEBOOK
 # ==========================================
+enviador = EnviadorFacebook(PAGE_ACCESS_TOKEN, limitador=estado_compartido.limitador("envio", ENVIO_TASA, 1))
+atexit.register(enviador.cerrar)
+
 def enviar_mensaje(id_usuario, texto):
-    url = f"https://graph.facebook.com/v18.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
-    try:
-        requests.post(url, json={"recipient": {"id": id_usuario}, "message": {"text": texto}})
-    except Exception as e:
-        print(f"Error enviando mensaje: {e}")
+    enviador.enviar_texto(id_usuario, texto)
 
 def enviar_imagen(id_usuario, url_img):
     if not url_img: return
-    url = f"https://graph.facebook.com/v18.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
-    payload = {
-        "recipient": {"id": id_usuario},
-        "message": {
-            "attachment": {
-                "type": "image",
-                "payload": {"url": url_img, "is_reusable": True}
-            }
-        }
-    }
-    try:
-        requests.post(url, json=payload)
-    except Exception as e:
-        print(f"Error enviando imagen: {e}")
+    enviador.enviar_imagen(id_usuario, url_img)
+
+def enviar_escribiendo(id_usuario):
+    enviador.enviar_accion(id_usuario, "typing_on")
 
 # ==========================================
 # 4. GESTIÓN DE DATOS (FIREBASE)
 # ==========================================
+sesiones = PersistenciaSesiones()
+atexit.register(sesiones.detener)
+
 def cargar_sesion(sender_id):
+    s = sesiones.cargar(sender_id)
+    if s and ("prods_cat" in s or "prods_cat_ids" in s):
+        # Sesiones antiguas con la lista de productos copiada: se descarta la navegación
+        s.pop("prods_cat", None)
+        s.pop("prods_cat_ids", None)
+        if s.get("estado") == "viendo_cat":
+            s["estado"] = "logueado" if s.get("telefono") else "inicio"
+    return s
+
+def tomar_lease_usuario(sender_id):
+    # Dos mensajes seguidos del mismo usuario pueden caer en workers distintos: sin el lease,
+    # la última escritura de la sesión pisaría el carrito o el cursor que guardó el otro
+    if not estado_compartido.compartido:
+        return None  # En memoria la cola ya atiende a cada usuario en un solo hilo
+    limite = time.monotonic() + SESION_LEASE_ESPERA
+    try:
+        while True:
+            lease = estado_compartido.adquirir("lease_sesion", sender_id, SESION_LEASE)
+            if lease is not None or time.monotonic() >= limite:
+                break
+            time.sleep(0.05)
+    except Exception as e:
+        print(f"⚠️ No se pudo tomar el lease de {sender_id}: {type(e).__name__} - {e}")
+        return None
+    if lease is None:
+        print(f"⚠️ La sesión de {sender_id} sigue ocupada tras {SESION_LEASE_ESPERA:.0f} s; se atiende sin lease")
+    return lease
+
+def tomar_estado_usuario(sender_id):
+    # Trae la sesión del backend compartido (o de Firestore) al worker que atiende el mensaje
+    lease = tomar_lease_usuario(sender_id)
+    s = estado_compartido.obtener("sesiones", sender_id)
+    if s is None: s = cargar_sesion(sender_id)
+    if s: user_state[sender_id] = s
+    return lease
+
+def liberar_estado_usuario(sender_id, lease=None):
+    s = user_state.pop(sender_id, None)
     try:
-        doc = db.collection("sesiones").document(sender_id).get()
-        return doc.to_dict() if doc.exists else None
-    except: return None
+        if s: estado_compartido.guardar("sesiones", sender_id, s, ttl=SESION_TTL)
+    finally:
+        if lease is not None:
+            try:
+                estado_compartido.liberar("lease_sesion", sender_id, lease)
+            except Exception as e:
+                # Si no se puede soltar, vence solo tras SESION_LEASE segundos
+                print(f"⚠️ No se pudo soltar el lease de {sender_id}: {type(e).__name__} - {e}")
+
+def carrito_usuario(sender_id):
+    return Carrito.desde_sesion(user_state.get(sender_id, {}).get("carrito"))
+
+def guardar_carrito(sender_id, carrito):
+    user_state.setdefault(sender_id, {})["carrito"] = carrito.a_dict()
 
 def guardar_sesion(sender_id):
-    try:
-        estado = user_state.get(sender_id)
-        if estado:
-            estado["ultima_actividad"] = datetime.now()
-            db.collection("sesiones").document(sender_id).set(estado)
-    except: pass
+    sesiones.marcar(sender_id, user_state.get(sender_id))
 
 def obtener_productos_con_cache():
-    global productos_cache
-    ahora = datetime.now()
-    if productos_cache["data"] and productos_cache["timestamp"]:
-        if (ahora - productos_cache["timestamp"]).total_seconds() < productos_cache["ttl"]:
-            return productos_cache["data"]
-    productos = obtener_productos()
-    productos_cache["data"] = productos
-    productos_cache["timestamp"] = ahora
-    return productos
-
-def reducir_stock(pid, cantidad):
-    try:
-        ref = db.collection("productos").document(pid)
-        doc = ref.get()
-        if not doc.exists: return False
-        stock = int(doc.to_dict().get("stock", 0))
-        if stock < cantidad: return False
-        ref.update({"stock": stock - cantidad})
-        productos_cache["data"] = None 
-        return True
-    except: return False
+    return catalogo.productos()
+
+def validar_imagenes_cambiadas(productos, cambiados):
+    validador_imagenes.programar([productos[pid].imagen_url for pid in cambiados if pid in productos])
+
+catalogo.suscribir(validar_imagenes_cambiadas)
+
+# Recuperación semántica opcional (IA_EMBEDDINGS=1): se actualiza con cada cambio del catálogo
+indice_semantico = crear_indice_semantico()
+if indice_semantico: catalogo.suscribir(indice_semantico.actualizar)
+
+def derivado_del_catalogo(nombre, construir):
+    # Se reconstruye solo cuando cambia la versión del catálogo
+    return catalogo.derivado(nombre, lambda prods: construir(prods, normalizar))
+
+def obtener_indice_productos():
+    return derivado_del_catalogo("indice", IndiceProductos)
+
+def obtener_recuperador_contexto():
+    return derivado_del_catalogo("recuperador", RecuperadorContexto)
+
+def obtener_vista_catalogo():
+    return catalogo.vista()
 
 def registrar_conversion(sender_id, pedido_id, total):
     try:
@@ -176,69 +214,46 @@ def registrar_conversion(sender_id, pedido_id, total):
 # ==========================================
 # 5. LÓGICA DE NEGOCIO Y IA
 # ==========================================
-def buscar_productos_clave(termino):
-    prods = obtener_productos_con_cache()
-    resultados = []
-    t = normalizar(termino)
-    for pid, d in prods.items():
-        nombre = normalizar(d.get("nombre", ""))
-        cat = normalizar(d.get("categoria", ""))
-        if t in nombre or t in cat:
-            d['id'] = pid
-            d['imagen_url'] = get_img_url(d) 
-            resultados.append(d)
-    return resultados
+def buscar_productos_clave(termino, limite=4):
+    # Se muestran 3; el cuarto solo indica que hay más resultados
+    indice = obtener_indice_productos()
+    return [indice.productos[pid] for pid in indice.buscar(termino, campos=("nombre", "categoria"), limite=limite)]
 
 def verificar_stock(pid):
     prods = obtener_productos_con_cache()
     # Los IDs en Firebase son las claves del diccionario 'prods'
     if pid in prods:
-        d = prods[pid]
+        p = prods[pid]
         return {
-            "nombre": d.get("nombre"),
-            "stock": d.get("stock", 0),
-            "imagen_url": get_img_url(d),
-            "disponible": int(d.get("stock", 0)) > 0
+            "nombre": p.nombre,
+            "stock": p.stock,
+            "imagen_url": get_img_url(p),
+            "disponible": p.disponible
         }
     return None
 
-def mi_ultimo_pedido(telefono):
-    try:
-        docs = db.collection("pedidos").where("telefono", "==", telefono)\
-                   .order_by("fecha", direction=firestore.Query.DESCENDING).limit(1).stream()
-        for d in docs:
-            ped = d.to_dict()
-            ped['id'] = d.id
-            return ped
-    except: return None
+cliente_ia = ClienteIA(HF_TOKEN)
+cache_ia = CacheRespuestas()
+
+def respuesta_sin_ia(ids, productos):
+    # Alternativa determinista cuando la IA no responde a tiempo
+    if not ids:
+        return "Dame un segundo, estoy revisando el almacén... Mientras tanto escribe *catalogo* o *buscar [producto]*."
+    lineas = [f"- {productos[pid].nombre} (ID: {pid}) | ${productos[pid].precio_texto}" for pid in ids[:3]]
+    return "🔍 Esto encontré en el catálogo:\n" + "\n".join(lineas) + "\n\nEscribe *pedido ID* para agregarlo al carrito."
 
 def consultar_ia(sender_id, mensaje):
     if not HF_TOKEN: return "⚠️ IA desactivada (Falta Token)."
+    ids = []
+    productos = {}
     try:
-        prods = obtener_productos_con_cache()
-        palabras = mensaje.lower().split()
-        relevantes = []
+        recuperador = obtener_recuperador_contexto()
+        productos = recuperador.productos
         
-        # 1. Recuperación: Más detalles del producto para la IA
-        for pid, p in prods.items():
-            texto_prod = (str(p.get("nombre")) + " " + str(p.get("categoria")) + " " + str(p.get("descripcion", ""))).lower()
-            
-            # Incluir descripción si existe, para preguntas más complejas
-            descripcion = p.get("descripcion", "Sin descripción")
-            
-            # Formato de información mejorado para la IA
-            info = (f"- {p.get('nombre')} (ID: {pid}) | Precio: ${p.get('precio')} | Stock: {p.get('stock')} | "
-                    f"Categoría: {p.get('categoria')} | Descripción: {descripcion}")
-            
-            # Condición de relevancia
-            match = any(word in texto_prod for word in palabras if len(word) > 3)
-            
-            if match: 
-                relevantes.append(info)
-
-        # Priorizamos los 10 productos más relevantes
-        lista_contexto = relevantes[:10]
-        contexto_str = "\n".join(lista_contexto)
+        # 1. Recuperación: fragmentos precalculados de los productos más relevantes (BM25 + embeddings)
+        semanticos = indice_semantico.buscar(mensaje) if indice_semantico else None
+        ids = recuperador.recuperar(mensaje, semanticos=semanticos)
+        contexto_str = "\n".join(recuperador.fragmentos[pid] for pid in ids)
         
         prompt = f"""
         [DIRECTIVA] Eres 'Frere's Bot', un vendedor experto, amable y conversacional.
@@ -255,427 +270,407 @@ def consultar_ia(sender_id, mensaje):
         - Sé breve y usa emojis.
         """
         
-        client = InferenceClient(token=HF_TOKEN)
-        resp = client.chat_completion(
+        # Preguntas repetidas con el mismo inventario se responden sin llamar al modelo
+        huella = huella_contexto(contexto_str)
+        cacheada = cache_ia.obtener(mensaje, huella)
+        if cacheada: return cacheada
+        
+        enviar_escribiendo(sender_id)
+        texto, completa = cliente_ia.generar(
             messages=[{"role":"system","content":prompt}, {"role":"user","content":mensaje}],
-            model="Qwen/Qwen2.5-7B-Instruct",
             max_tokens=200, 
             temperature=0.4 # Aumentamos un poco para respuestas más creativas/conversacionales
         )
-        return resp.choices[0].message.content
+        if completa: cache_ia.guardar(mensaje, huella, texto)
+        return texto or respuesta_sin_ia(ids, productos)
     except Exception as e:
         print(f"Error IA: {e}")
-        return "Dame un segundo, estoy revisando el almacén..."
+        return respuesta_sin_ia(ids, productos)
+
+# --- Navegación por categoría (cursor en la sesión) ---
+def cursor_categoria(sender_id, vista):
+    """Devuelve (ids de la categoría, posición actual) reubicando el cursor si cambió el catálogo."""
+    s = user_state[sender_id]
+    ids = vista.por_categoria.get(s.get("cat"), ())
+    idx = s.get("idx", 0)
+    if s.get("cat_version") != catalogo.version:
+        # Se busca el producto que estaba viendo para no saltar ni repetir productos
+        if s.get("cat_pid") in ids:
+            idx = ids.index(s["cat_pid"])
+        s["cat_version"] = catalogo.version
+        s["idx"] = idx
+    return ids, idx
+
+def precargar_imagen(ids, idx, prods):
+    # Valida en segundo plano la imagen del siguiente producto antes de que la pidan
+    if idx < len(ids):
+        validador_imagenes.programar([prods[ids[idx]].imagen_url])
 
 # ==========================================
 # 6. CEREBRO DEL BOT (Manejo de Mensajes)
 # ==========================================
-def manejar_mensaje(sender_id, msg):
-    # Recuperamos el estado actual. Si no existe, es "inicio".
-    usuario_data = user_state.get(sender_id, {})
-    estado = usuario_data.get("estado", "inicio")
-    prods_cache = obtener_productos_con_cache()
-
-    # --- 0. COMANDO DE CANCELACIÓN (Prioridad Máxima) ---
-    if msg == "cancelar":
-        carrito_tenia_items = len(user_state.get(sender_id, {}).get("carrito", [])) > 0
-        estado_actual = user_state.get(sender_id, {}).get("estado", "inicio")
-        
-        # Preservar datos del usuario si está logueado
-        telefono = user_state.get(sender_id, {}).get("telefono")
-        nombre = user_state.get(sender_id, {}).get("nombre")
-        direccion = user_state.get(sender_id, {}).get("direccion")
-        
-        if telefono:
-            user_state[sender_id] = {
-                "estado": "logueado",
-                "telefono": telefono,
-                "nombre": nombre,
-                "direccion": direccion,
-                "carrito": []  # Vaciar carrito
-            }
-        else:
-            user_state[sender_id] = {"estado": "inicio", "carrito": []}
-        
-        # Mensaje según contexto
-        if carrito_tenia_items:
-            return "❌ Pedido cancelado y carrito vaciado. ¿En qué más puedo ayudarte?"
-        elif estado_actual in ["reg_nombre", "reg_tel", "reg_dir"]:
-            return "❌ Registro cancelado. ¿En qué puedo ayudarte?"
-        elif estado_actual == "login":
-            return "❌ Inicio de sesión cancelado. ¿En qué puedo ayudarte?"
-        elif estado_actual == "viendo_cat":
-            return "❌ Navegación cancelada. ¿En qué puedo ayudarte?"
-        else:
-            return "❌ Operación cancelada. ¿En qué puedo ayudarte?"
-
-    # --- 1. FLUJOS ACTIVOS (Registro/Login) ---
-    if estado == "reg_nombre":
-        # Permitir salir del flujo de registro
-        if "entrar" in msg or "login" in msg:
-            user_state[sender_id] = {"estado": "login"}
-            return "🔐 Por favor, escribe tu número de teléfono registrado:"
-        
-        user_state[sender_id]["nombre"] = msg
-        user_state[sender_id]["estado"] = "reg_tel"
-        return "📱 Gracias. Ahora escribe tu teléfono (10 dígitos):\n\n(Escribe *cancelar* en cualquier momento para salir)"
+def fin_de_flujo(sender_id):
+    # Estado al salir de un flujo: logueado si ya sabemos quién es
+    user_state[sender_id]["estado"] = "logueado" if user_state[sender_id].get("telefono") else "inicio"
+
+# --- 0. COMANDO DE CANCELACIÓN (Prioridad Máxima) ---
+def intencion_cancelar(sender_id, msg, dato):
+    carrito_tenia_items = len(user_state.get(sender_id, {}).get("carrito", {})) > 0
+    estado_actual = user_state.get(sender_id, {}).get("estado", "inicio")
     
-    if estado == "reg_tel":
-        # Permitir cambiar a login
-        if "entrar" in msg or "login" in msg:
-            user_state[sender_id] = {"estado": "login"}
-            return "🔐 Por favor, escribe tu número de teléfono registrado:"
-        
-        if not msg.isdigit() or len(msg) != 10: 
-            return "❌ Número inválido. Por favor escribe solo los 10 dígitos (Ej: 5512345678).\n\n(Escribe *cancelar* para salir)"
-        
-        user_state[sender_id]["telefono"] = msg
-        user_state[sender_id]["estado"] = "reg_dir"
-        return "📍 ¡Casi listo! Escribe tu dirección de entrega:"
+    # Preservar datos del usuario si está logueado
+    telefono = user_state.get(sender_id, {}).get("telefono")
+    nombre = user_state.get(sender_id, {}).get("nombre")
+    direccion = user_state.get(sender_id, {}).get("direccion")
     
-    if estado == "reg_dir":
-        # Permitir cambiar a login
-        if "entrar" in msg or "login" in msg:
-            user_state[sender_id] = {"estado": "login"}
-            return "🔐 Por favor, escribe tu número de teléfono registrado:"
-        
-        try:
-            tel = user_state[sender_id].get("telefono")
-            nombre = user_state[sender_id].get("nombre")
-            
-            db.collection("usuarios").document(tel).set({
-                "nombre": nombre,
-                "telefono": tel,
-                "direccion": msg,
-                "rol": "Cliente",
-                "Fecha_registro": datetime.now().strftime("%d/%m/%y")
-            })
-            
-            user_state[sender_id]["estado"] = "logueado"
-            user_state[sender_id]["direccion"] = msg
-            return "✅ ¡Registro completado con éxito!\n\nYa puedes hacer pedidos. Escribe *catalogo* para ver nuestros productos."
-        except Exception as e:
-            print(f"Error Registro: {e}")
-            user_state[sender_id]["estado"] = "inicio"
-            return "❌ Hubo un error al guardar tus datos. Intenta escribir *registrar* nuevamente."
-
-    if estado == "login":
-        # Permitir salir del flujo de login si el usuario quiere registrarse
-        if "registrar" in msg or "crear cuenta" in msg:
-            user_state[sender_id] = {"estado": "reg_nombre"}
-            return "📝 ¡Bienvenido! Para registrarte, primero escribe tu nombre completo:"
-        
-        # Verificar que el mensaje parece un número de teléfono
-        if not msg.isdigit():
-            return "❌ Por favor escribe tu número de teléfono (10 dígitos) o *registrar* para crear cuenta nueva."
-        
-        doc = db.collection("usuarios").document(msg).get()
-        if not doc.exists: 
-            return "❌ No encontré ese número. Verifica o escribe *registrar* para crear cuenta."
-        
-        d = doc.to_dict()
-        cart = user_state.get(sender_id, {}).get("carrito", [])
-        
+    if telefono:
         user_state[sender_id] = {
-            "estado": "logueado", 
-            "nombre": d.get('nombre'), 
-            "telefono": msg, 
-            "direccion": d.get('direccion'), 
-            "carrito": cart
+            "estado": "logueado",
+            "telefono": telefono,
+            "nombre": nombre,
+            "direccion": direccion,
+            "carrito": {}  # Vaciar carrito
         }
-        return f"👋 ¡Bienvenido de nuevo, {d.get('nombre')}!"
+    else:
+        user_state[sender_id] = {"estado": "inicio", "carrito": {}}
+    
+    # Mensaje según contexto
+    if carrito_tenia_items:
+        return "❌ Pedido cancelado y carrito vaciado. ¿En qué más puedo ayudarte?"
+    elif estado_actual in ["reg_nombre", "reg_tel", "reg_dir"]:
+        return "❌ Registro cancelado. ¿En qué puedo ayudarte?"
+    elif estado_actual == "login":
+        return "❌ Inicio de sesión cancelado. ¿En qué puedo ayudarte?"
+    elif estado_actual == "viendo_cat":
+        return "❌ Navegación cancelada. ¿En qué puedo ayudarte?"
+    else:
+        return "❌ Operación cancelada. ¿En qué puedo ayudarte?"
+
+# --- 1. FLUJOS ACTIVOS (Registro/Login) ---
+def intencion_reg_nombre(sender_id, msg, dato):
+    user_state[sender_id]["nombre"] = msg
+    user_state[sender_id]["estado"] = "reg_tel"
+    return "📱 Gracias. Ahora escribe tu teléfono (10 dígitos):\n\n(Escribe *cancelar* en cualquier momento para salir)"
+
+def intencion_reg_tel(sender_id, msg, dato):
+    if not msg.isdigit() or len(msg) != 10: 
+        return "❌ Número inválido. Por favor escribe solo los 10 dígitos (Ej: 5512345678).\n\n(Escribe *cancelar* para salir)"
+    
+    user_state[sender_id]["telefono"] = msg
+    user_state[sender_id]["estado"] = "reg_dir"
+    return "📍 ¡Casi listo! Escribe tu dirección de entrega:"
 
-    # --- 2. ACTIVADORES DE REGISTRO / LOGIN ---
-    if "registrar" in msg or "crear cuenta" in msg:
-        user_state[sender_id] = {"estado": "reg_nombre"}
-        return "📝 ¡Bienvenido! Para registrarte, primero escribe tu nombre completo:"
+def intencion_reg_dir(sender_id, msg, dato):
+    try:
+        tel = user_state[sender_id].get("telefono")
+        nombre = user_state[sender_id].get("nombre")
+        
+        db.collection("usuarios").document(tel).set({
+            "nombre": nombre,
+            "telefono": tel,
+            "direccion": msg,
+            "rol": "Cliente",
+            "Fecha_registro": datetime.now().strftime("%d/%m/%y")
+        })
+        
+        user_state[sender_id]["estado"] = "logueado"
+        user_state[sender_id]["direccion"] = msg
+        return "✅ ¡Registro completado con éxito!\n\nYa puedes hacer pedidos. Escribe *catalogo* para ver nuestros productos."
+    except Exception as e:
+        print(f"Error Registro: {e}")
+        user_state[sender_id]["estado"] = "inicio"
+        return "❌ Hubo un error al guardar tus datos. Intenta escribir *registrar* nuevamente."
+
+def intencion_login_telefono(sender_id, msg, dato):
+    # Verificar que el mensaje parece un número de teléfono
+    if not msg.isdigit():
+        return "❌ Por favor escribe tu número de teléfono (10 dígitos) o *registrar* para crear cuenta nueva."
+    
+    doc = db.collection("usuarios").document(msg).get()
+    if not doc.exists: 
+        return "❌ No encontré ese número. Verifica o escribe *registrar* para crear cuenta."
+    
+    d = doc.to_dict()
+    cart = user_state.get(sender_id, {}).get("carrito", {})
+    
+    user_state[sender_id] = {
+        "estado": "logueado", 
+        "nombre": d.get('nombre'), 
+        "telefono": msg, 
+        "direccion": d.get('direccion'), 
+        "carrito": cart
+    }
+    return f"👋 ¡Bienvenido de nuevo, {d.get('nombre')}!"
+
+# --- 2. ACTIVADORES DE REGISTRO / LOGIN ---
+def intencion_registrar(sender_id, msg, dato):
+    user_state[sender_id] = {"estado": "reg_nombre"}
+    return "📝 ¡Bienvenido! Para registrarte, primero escribe tu nombre completo:"
 
-    if msg.startswith("iniciar") or "entrar" in msg or "login" in msg:
-        user_state[sender_id] = {"estado": "login"}
-        return "🔐 Por favor, escribe tu número de teléfono registrado:"
+def intencion_login(sender_id, msg, dato):
+    user_state[sender_id] = {"estado": "login"}
+    return "🔐 Por favor, escribe tu número de teléfono registrado:"
 
-    # --- 3. COMANDOS GENERALES ---
-    if any(x in msg for x in ["hola", "inicio", "menu", "buenos dias", "buenas tardes"]):
-        return "👋 ¡Hola! Soy Frere's Bot.\n\nEscribe:\n🛍 *Catalogo*\n🔍 *Buscar (producto)*\n🆕 *Novedades*\n📦 *Mi Pedido*\n👤 *Registrar / Entrar*"
+# --- 3. COMANDOS GENERALES ---
+def intencion_saludo(sender_id, msg, dato):
+    return "👋 ¡Hola! Soy Frere's Bot.\n\nEscribe:\n🛍 *Catalogo*\n🔍 *Buscar (producto)*\n🆕 *Novedades*\n📦 *Mi Pedido*\n👤 *Registrar / Entrar*"
 
-    if "contacto" in msg: return "📞 WhatsApp: 55-1234-5678"
+def intencion_contacto(sender_id, msg, dato):
+    return "📞 WhatsApp: 55-1234-5678"
+
+# --- NOVEDADES / OFERTAS ---
+def intencion_novedades(sender_id, msg, dato):
+    vista = obtener_vista_catalogo()
+    es_oferta = "oferta" in msg
+    items = [vista.productos[pid] for pid in (vista.ofertas if es_oferta else vista.novedades)[:3]]
     
-    # --- NOVEDADES / OFERTAS ---
-    if any(x in msg for x in ["nuevo", "novedad", "oferta"]):
-        es_oferta = "oferta" in msg
-        items = []
-        for pid, d in prods_cache.items():
-            if (es_oferta and d.get('oferta')) or (not es_oferta):
-                d['id'] = pid
-                d['imagen_url'] = get_img_url(d) 
-                items.append(d)
-        
-        items = items[:3]
-        if not items: return "No encontré productos en esta sección."
-        
-        titulo = "🔥 *OFERTAS:*" if es_oferta else "🆕 *NOVEDADES:*"
-        enviar_mensaje(sender_id, titulo)
-
-        for p in items:
-            txt = f"🔹 *{p['nombre']}* (ID: {p['id']})\n💲 ${p['precio']}\nStock: {p['stock']}"
-            enviar_mensaje(sender_id, txt)
-            enviar_imagen(sender_id, p['imagen_url'])
-        return None 
-
-    # --- BÚSQUEDA ---
-    if msg.startswith("buscar"):
-        term = msg.replace("buscar", "").strip()
-        if len(term) < 2: return "🔍 Escribe: *buscar camisa*"
-        
-        items = buscar_productos_clave(term)
-        if not items: return f"😕 No encontré '{term}'."
-        
-        enviar_mensaje(sender_id, f"🔍 Resultados para '{term}':")
-        for p in items[:3]:
-            txt = f"🔸 *{p['nombre']}* (ID: {p['id']})\n💲 ${p['precio']}"
-            enviar_mensaje(sender_id, txt)
-            enviar_imagen(sender_id, p['imagen_url'])
-            
-        if len(items) > 3: enviar_mensaje(sender_id, "ℹ️ Hay más resultados, intenta ser más específico.")
-        return None
+    if not items: return "No encontré productos en esta sección."
+    
+    titulo = "🔥 *OFERTAS:*" if es_oferta else "🆕 *NOVEDADES:*"
+    enviar_mensaje(sender_id, titulo)
 
-    # --- STOCK POR ID (Prioridad Media) ---
-    if msg.startswith("stock"):
-        import re
-        m = re.search(r'\d+', msg)
-        
-        if estado == "viendo_cat":
-            user_state[sender_id]["estado"] = "logueado" if user_state[sender_id].get("telefono") else "inicio"
-            
-        if not m: return "📦 Escribe: *stock ID*"
-        
-        pid_solicitado = m.group(0) 
-        info = verificar_stock(pid_solicitado)
-        
-        if not info: return "❌ ID no encontrado." 
-        
-        txt = f"📦 *{info['nombre']}*\nStock: {info['stock']} unidades"
-        if not info['disponible']: txt += " (Agotado)"
+    for p in items:
+        txt = f"🔹 *{p.nombre}* (ID: {p.id})\n💲 ${p.precio_texto}\nStock: {p.stock}"
         enviar_mensaje(sender_id, txt)
-        enviar_imagen(sender_id, info['imagen_url'])
-        return None
+        enviar_imagen(sender_id, get_img_url(p))
+    return None 
 
-    # --- CARRITO ---
-    if "carrito" in msg and "ver" in msg:
-        c = user_state.get(sender_id, {}).get("carrito", [])
-        if not c: return "🛒 Tu carrito está vacío."
-        txt = "🛒 *Tu Pedido:*\n"
-        total = 0
-        items_validos = 0
-        for it in c:
-            try:
-                precio = it.get('precio', 0)
-                cantidad = it.get('cantidad', 1)
-                nombre = it.get('nombre', 'Producto desconocido')
-                # Asegurar que son números
-                if isinstance(precio, str):
-                    precio = float(precio.replace('$', '').replace(',', ''))
-                if isinstance(cantidad, str):
-                    cantidad = int(cantidad)
-                sub = precio * cantidad
-                total += sub
-                txt += f"- {cantidad}x {nombre} (${sub:.2f})\n"
-                items_validos += 1
-            except Exception as e:
-                print(f"Error en item del carrito: {e}")
-                continue
-        
-        if items_validos == 0:
-            user_state[sender_id]["carrito"] = []
-            return "🛒 Tu carrito está vacío o tiene productos inválidos."
-        
-        txt += f"\n💰 Total: ${total:.2f}\nEscribe *finalizar* para comprar o *vaciar* para limpiar."
-        return txt
-
-    if "vaciar" in msg:
-        if sender_id in user_state: user_state[sender_id]["carrito"] = []
-        return "🗑️ Carrito vaciado."
-
-    # --- PEDIDOS ---
-    if "mi pedido" in msg:
-        tel = user_state.get(sender_id, {}).get("telefono")
-        if not tel: return "🔒 Inicia sesión (escribe *entrar*) para ver tus pedidos."
-        ped = mi_ultimo_pedido(tel)
-        if not ped: return "No tienes pedidos recientes."
-        return f"🧾 Pedido #{ped['id']}\nEstado: {ped.get('estado')}\nTotal: ${ped.get('total')}"
-
-    # --- CATÁLOGO ---
-    all_cats_map = {}
-    for p in prods_cache.values():
-        c_raw = p.get('categoria', 'Varios')
-        all_cats_map[normalizar(c_raw)] = c_raw
-
-    if "catalogo" in msg:
-        if sender_id not in user_state: user_state[sender_id] = {"estado": "inicio"}
-        cats_uniques = list(set(all_cats_map.values()))
-        return "📂 *Categorías Disponibles:*\n" + "\n".join([f"- {c}" for c in cats_uniques]) + "\n\nEscribe el nombre de una categoría."
-
-    # Detección de Categoría
-    cat_match = None
-    if msg in all_cats_map: cat_match = msg
+# --- BÚSQUEDA ---
+def intencion_buscar(sender_id, msg, dato):
+    term = msg.replace("buscar", "").strip()
+    if len(term) < 2: return "🔍 Escribe: *buscar camisa*"
+    
+    items = buscar_productos_clave(term)
+    if not items: return f"😕 No encontré '{term}'."
     
-    if cat_match:
-        cat_real_name = all_cats_map[cat_match]
-        prods = []
-        for pid, p in prods_cache.items():
-            if normalizar(p.get('categoria', '')) == cat_match:
-                p['id'] = pid
-                prods.append(p)
+    enviar_mensaje(sender_id, f"🔍 Resultados para '{term}':")
+    for p in items[:3]:
+        txt = f"🔸 *{p.nombre}* (ID: {p.id})\n💲 ${p.precio_texto}"
+        enviar_mensaje(sender_id, txt)
+        enviar_imagen(sender_id, get_img_url(p))
         
-        if not prods: return f"La categoría '{cat_real_name}' está vacía."
+    if len(items) > 3: enviar_mensaje(sender_id, "ℹ️ Hay más resultados, intenta ser más específico.")
+    return None
 
-        for p in prods: p['imagen_url'] = get_img_url(p)
-        user_state[sender_id]["prods_cat"] = prods
-        user_state[sender_id]["idx"] = 0
-        user_state[sender_id]["estado"] = "viendo_cat"
+# --- STOCK POR ID ---
+def intencion_stock(sender_id, msg, dato):
+    m = re.search(r'\d+', msg)
+    
+    if user_state.get(sender_id, {}).get("estado") == "viendo_cat":
+        fin_de_flujo(sender_id)
         
-        p = prods[0]
-        txt = f"📂 *Categoría: {cat_real_name}*\n\n🔹 *{p['nombre']}* (ID: {p['id']})\n💲 ${p['precio']}\n\nEscribe *si* para agregar, *no* para ver el siguiente, o *stock {p['id']}* para existencias exactas."
-        enviar_mensaje(sender_id, txt)
-        enviar_imagen(sender_id, p['imagen_url'])
-        return None
+    if not m: return "📦 Escribe: *stock ID*"
+    
+    pid_solicitado = m.group(0) 
+    info = verificar_stock(pid_solicitado)
+    
+    if not info: return "❌ ID no encontrado." 
+    
+    txt = f"📦 *{info['nombre']}*\nStock: {info['stock']} unidades"
+    if not info['disponible']: txt += " (Agotado)"
+    enviar_mensaje(sender_id, txt)
+    enviar_imagen(sender_id, info['imagen_url'])
+    return None
 
-    if estado == "viendo_cat":
-        # Permitir salir del catálogo con comandos comunes
-        if any(x in msg for x in ["catalogo", "menu", "hola", "registrar", "entrar"]):
-            user_state[sender_id]["estado"] = "logueado" if user_state[sender_id].get("telefono") else "inicio"
-            # Re-procesar el mensaje como si fuera nuevo
-            return manejar_mensaje(sender_id, msg)
-        
-        if msg in ["no", "siguiente", "otro"]:
-            idx = user_state[sender_id].get("idx", 0) + 1
-            prods = user_state[sender_id].get("prods_cat", [])
-            if not prods or idx >= len(prods):
-                user_state[sender_id]["estado"] = "logueado" if user_state[sender_id].get("telefono") else "inicio"
-                return "🏁 Fin de la categoría. Escribe *catalogo* para ver otras."
-            user_state[sender_id]["idx"] = idx
-            p = prods[idx]
-            txt = f"🔹 *{p['nombre']}* (ID: {p['id']})\n💲 ${p['precio']}\n\n¿Lo agregamos? Escribe *salir* para volver al menú."
-            enviar_mensaje(sender_id, txt)
-            enviar_imagen(sender_id, p['imagen_url'])
-            return None
-        
-        if msg in ["si", "lo quiero", "agregar"]:
-            prods = user_state[sender_id].get("prods_cat", [])
-            idx = user_state[sender_id].get("idx", 0)
-            if not prods or idx >= len(prods):
-                user_state[sender_id]["estado"] = "inicio"
-                return "❌ Error interno. Escribe *catalogo* para empezar de nuevo."
-            p = prods[idx]
-            cart = user_state[sender_id].setdefault("carrito", [])
-            cart.append({"id": p['id'], "nombre": p['nombre'], "precio": p['precio'], "cantidad": 1})
-            return "🛒 Agregado. Escribe *siguiente* para ver más o *finalizar* para pagar."
-        
-        # Si escribe "salir" o cualquier otra cosa no reconocida en viendo_cat
-        if msg == "salir":
-            user_state[sender_id]["estado"] = "logueado" if user_state[sender_id].get("telefono") else "inicio"
-            return "👋 Saliste del catálogo. ¿En qué más puedo ayudarte?"
-
-    # --- AGREGAR POR ID ---
-    if msg.startswith("pedido") or (msg.isdigit() and len(msg) <= 4):
-        import re
-        pid_match = re.search(r'\d+', msg)
-        if pid_match:
-            pid = pid_match.group(0)
-            info = verificar_stock(pid)
-            if info and info['disponible']:
-                cart = user_state.setdefault(sender_id, {}).setdefault("carrito", [])
-                prods = obtener_productos_con_cache()
-                # Protección contra KeyError
-                if pid not in prods:
-                    return "❌ Producto no encontrado."
-                precio = prods[pid].get('precio', 0)
-                cart.append({"id": pid, "nombre": info['nombre'], "precio": precio, "cantidad": 1})
-                return f"🛒 {info['nombre']} agregado al carrito."
-            return "❌ ID no válido o producto agotado."
-
-    # --- FINALIZAR PEDIDO ---
-    if "finalizar" in msg or "comprar" in msg:
-        cart = user_state.get(sender_id, {}).get("carrito")
-        if not cart: return "🛒 Tu carrito está vacío."
-        
-        if not user_state.get(sender_id, {}).get("telefono"):
-            return "🛑 Para procesar tu compra necesito saber quién eres.\n\nEscribe *registrar* (si eres nuevo) o *entrar*."
-        
-        try:
-            # Validar que todos los items del carrito tengan datos correctos
-            items_validos = []
-            items_sin_stock = []
-            
-            for item in cart:
-                # Verificar que el item tiene los campos necesarios
-                if not item.get('id') or not item.get('nombre'):
-                    continue
-                
-                # Verificar stock actual antes de procesar
-                info_stock = verificar_stock(item['id'])
-                cantidad = item.get('cantidad', 1)
-                
-                if not info_stock or not info_stock.get('disponible'):
-                    items_sin_stock.append(item['nombre'])
-                elif int(info_stock.get('stock', 0)) < cantidad:
-                    items_sin_stock.append(f"{item['nombre']} (solo hay {info_stock['stock']})")
-                else:
-                    # Asegurar que precio es numérico
-                    precio = item.get('precio', 0)
-                    if isinstance(precio, str):
-                        try:
-                            precio = float(precio.replace('$', '').replace(',', ''))
-                        except:
-                            precio = 0
-                    item['precio'] = precio
-                    items_validos.append(item)
-            
-            # Si hay productos sin stock, notificar
-            if items_sin_stock:
-                return f"⚠️ Algunos productos no tienen stock suficiente:\n- " + "\n- ".join(items_sin_stock) + "\n\nEscríbeme para buscar alternativas."
-            
-            if not items_validos:
-                user_state[sender_id]["carrito"] = []
-                return "❌ Tu carrito no tiene productos válidos. Escribe *catalogo* para agregar productos."
-            
-            total = sum([i['precio'] * i.get('cantidad', 1) for i in items_validos])
-            
-            # Verificar que tenemos todos los datos del usuario
-            telefono = user_state[sender_id].get("telefono")
-            nombre = user_state[sender_id].get("nombre", "Sin nombre")
-            direccion = user_state[sender_id].get("direccion", "Sin dirección")
-            
-            pedido = {
-                "telefono": telefono,
-                "nombre": nombre,
-                "direccion": direccion,
-                "fecha": datetime.now(),
-                "estado": "pendiente",
-                "productos": items_validos,
-                "total": total,
-                "entrega": "pendiente"
-            }
-            
-            # Intentar guardar el pedido
-            ref = db.collection("pedidos").add(pedido)
-            
-            # Reducir stock solo después de guardar el pedido exitosamente
-            for item in items_validos:
-                if item['id'] != "CATALOGO": 
-                    if not reducir_stock(item['id'], item.get('cantidad', 1)):
-                        print(f"⚠️ Error reduciendo stock de {item['id']}")
-            
-            registrar_conversion(sender_id, ref[1].id, total)
-            user_state[sender_id]["carrito"] = []
-            return f"✅ ¡Pedido #{ref[1].id} Recibido!\nTotal: ${total}\n📍 Enviaremos a: {direccion}\nNos pondremos en contacto contigo."
-        
-        except Exception as e:
-            print(f"Error al crear pedido: {e}")
-            return "❌ Hubo un error al procesar tu pedido. Por favor intenta de nuevo o escribe *contacto* para ayuda."
+# --- CARRITO ---
+def intencion_ver_carrito(sender_id, msg, dato):
+    c = carrito_usuario(sender_id)
+    if not c: return "🛒 Tu carrito está vacío."
+    txt = "🛒 *Tu Pedido:*\n"
+    for _, linea in c:
+        txt += f"- {linea.cantidad}x {linea.nombre} (${linea.subtotal:.2f})\n"
+    txt += f"\n💰 Total: ${c.total:.2f}\nEscribe *finalizar* para comprar o *vaciar* para limpiar."
+    return txt
+
+def intencion_vaciar(sender_id, msg, dato):
+    if sender_id in user_state: user_state[sender_id]["carrito"] = {}
+    return "🗑️ Carrito vaciado."
+
+# --- PEDIDOS ---
+def intencion_mi_pedido(sender_id, msg, dato):
+    tel = user_state.get(sender_id, {}).get("telefono")
+    if not tel: return "🔒 Inicia sesión (escribe *entrar*) para ver tus pedidos."
+    ped = ultimo_pedido(tel)
+    if not ped: return "No tienes pedidos recientes."
+    return f"🧾 Pedido #{ped['id']}\nEstado: {ped.get('estado')}\nTotal: ${ped.get('total')}"
+
+def intencion_historial(sender_id, msg, dato, cursor=None):
+    tel = user_state.get(sender_id, {}).get("telefono")
+    if not tel: return "🔒 Inicia sesión (escribe *entrar*) para ver tus pedidos."
+    pedidos, siguiente = historial(tel, limite=5, cursor=cursor)
+    if not pedidos: return "No tienes pedidos recientes." if cursor is None else "No hay más pedidos."
+    txt = "🧾 *Tus pedidos:*\n"
+    for ped in pedidos:
+        fecha = ped.get("fecha")
+        txt += f"- #{ped['id']} ({fecha.strftime('%d/%m/%y') if hasattr(fecha, 'strftime') else 's/f'}) {ped.get('estado')} · ${ped.get('total')}\n"
+    # El cursor de la página siguiente queda en la sesión
+    user_state[sender_id]["historial_cursor"] = siguiente
+    if siguiente: txt += "\nEscribe *mas pedidos* para ver anteriores."
+    return txt
+
+def intencion_mas_pedidos(sender_id, msg, dato):
+    s = user_state.get(sender_id, {})
+    if "historial_cursor" not in s: return intencion_historial(sender_id, msg, dato)
+    if not s["historial_cursor"]: return "No hay más pedidos."
+    return intencion_historial(sender_id, msg, dato, cursor=s["historial_cursor"])
+
+# --- CATÁLOGO ---
+def intencion_catalogo(sender_id, msg, dato):
+    vista = obtener_vista_catalogo()
+    if sender_id not in user_state: user_state[sender_id] = {"estado": "inicio"}
+    return "📂 *Categorías Disponibles:*\n" + "\n".join([f"- {nombre} ({vista.conteos[c]})" for c, nombre in vista.nombres.items()]) + "\n\nEscribe el nombre de una categoría."
+
+def intencion_categoria(sender_id, msg, cat_match):
+    vista = obtener_vista_catalogo()
+    cat_real_name = vista.nombres[cat_match]
+    ids = vista.por_categoria[cat_match]
+    if not ids: return f"La categoría '{cat_real_name}' está vacía."
+
+    # La sesión solo guarda un cursor; los productos se resuelven al mostrarlos
+    user_state.setdefault(sender_id, {}).update({
+        "estado": "viendo_cat", "cat": cat_match, "idx": 0,
+        "cat_version": catalogo.version, "cat_pid": ids[0]
+    })
+    
+    p = vista.productos[ids[0]]
+    precargar_imagen(ids, 1, vista.productos)
+    txt = f"📂 *Categoría: {cat_real_name}*\n\n🔹 *{p.nombre}* (ID: {p.id})\n💲 ${p.precio_texto}\n\nEscribe *si* para agregar, *no* para ver el siguiente, o *stock {p.id}* para existencias exactas."
+    enviar_mensaje(sender_id, txt)
+    enviar_imagen(sender_id, get_img_url(p))
+    return None
 
-    # --- IA POR DEFECTO ---
-    return consultar_ia(sender_id, msg)
+# --- NAVEGACIÓN DENTRO DE LA CATEGORÍA (estado viendo_cat) ---
+def intencion_siguiente(sender_id, msg, dato):
+    vista = obtener_vista_catalogo()
+    ids, idx = cursor_categoria(sender_id, vista)
+    idx += 1
+    if idx >= len(ids):
+        fin_de_flujo(sender_id)
+        return "🏁 Fin de la categoría. Escribe *catalogo* para ver otras."
+    user_state[sender_id]["idx"] = idx
+    user_state[sender_id]["cat_pid"] = ids[idx]
+    p = vista.productos[ids[idx]]
+    precargar_imagen(ids, idx + 1, vista.productos)
+    txt = f"🔹 *{p.nombre}* (ID: {p.id})\n💲 ${p.precio_texto}\n\n¿Lo agregamos? Escribe *salir* para volver al menú."
+    enviar_mensaje(sender_id, txt)
+    enviar_imagen(sender_id, get_img_url(p))
+    return None
+
+def intencion_agregar(sender_id, msg, dato):
+    vista = obtener_vista_catalogo()
+    ids, idx = cursor_categoria(sender_id, vista)
+    if idx >= len(ids):
+        user_state[sender_id]["estado"] = "inicio"
+        return "❌ Error interno. Escribe *catalogo* para empezar de nuevo."
+    pid = ids[idx]
+    p = vista.productos[pid]
+    cart = carrito_usuario(sender_id)
+    cart.agregar(pid, p.nombre, p.precio)
+    guardar_carrito(sender_id, cart)
+    return "🛒 Agregado. Escribe *siguiente* para ver más o *finalizar* para pagar."
+
+def intencion_salir(sender_id, msg, dato):
+    fin_de_flujo(sender_id)
+    return "👋 Saliste del catálogo. ¿En qué más puedo ayudarte?"
+
+# --- AGREGAR POR ID ---
+def intencion_pedido_id(sender_id, msg, pid):
+    info = verificar_stock(pid)
+    if info and info['disponible']:
+        prods = obtener_productos_con_cache()
+        # Protección contra KeyError
+        if pid not in prods:
+            return "❌ Producto no encontrado."
+        precio = prods[pid].precio
+        cart = carrito_usuario(sender_id)
+        cart.agregar(pid, info['nombre'], precio)
+        guardar_carrito(sender_id, cart)
+        return f"🛒 {info['nombre']} agregado al carrito."
+    return "❌ ID no válido o producto agotado."
+
+# --- FINALIZAR PEDIDO ---
+def intencion_finalizar(sender_id, msg, dato):
+    cart = carrito_usuario(sender_id)
+    if not cart: return "🛒 Tu carrito está vacío."
+    
+    if not user_state.get(sender_id, {}).get("telefono"):
+        return "🛑 Para procesar tu compra necesito saber quién eres.\n\nEscribe *registrar* (si eres nuevo) o *entrar*."
+    
+    cantidades = cart.cantidades()
+    precios = {pid: linea.precio for pid, linea in cart}
+
+    # Verificar que tenemos todos los datos del usuario
+    direccion = user_state[sender_id].get("direccion", "Sin dirección")
+    pedido = {
+        "telefono": user_state[sender_id].get("telefono"),
+        "nombre": user_state[sender_id].get("nombre", "Sin nombre"),
+        "direccion": direccion,
+        "fecha": datetime.now(),
+        "estado": "pendiente",
+        "entrega": "pendiente"
+    }
+
+    try:
+        # Validación de stock, descuento y alta del pedido en una sola transacción
+        pedido_id, total, _ = crear_pedido_atomico(cantidades, pedido, precios=precios)
+    except StockInsuficiente as e:
+        return f"⚠️ Algunos productos no tienen stock suficiente:\n- " + "\n- ".join(e.faltantes) + "\n\nEscríbeme para buscar alternativas."
+    except Exception as e:
+        print(f"Error al crear pedido: {e}")
+        return "❌ Hubo un error al procesar tu pedido. Por favor intenta de nuevo o escribe *contacto* para ayuda."
+
+    # Con listener el cambio de stock llega solo por snapshot; sin él, se fuerza la recarga
+    catalogo.invalidar()
+    registrar_conversion(sender_id, pedido_id, total)
+    user_state[sender_id]["carrito"] = {}
+    return f"✅ ¡Pedido #{pedido_id} Recibido!\nTotal: ${total}\n📍 Enviaremos a: {direccion}\nNos pondremos en contacto contigo."
+
+def intencion_en_categoria(msg):
+    return obtener_vista_catalogo().categoria(msg)
+
+router_intenciones = Router(reglas_bot(intencion_en_categoria))
+
+# Intención -> manejador(sender_id, msg, dato)
+MANEJADORES = {
+    "cancelar": intencion_cancelar,
+    "reg_nombre": intencion_reg_nombre,
+    "reg_tel": intencion_reg_tel,
+    "reg_dir": intencion_reg_dir,
+    "login_telefono": intencion_login_telefono,
+    "registrar": intencion_registrar,
+    "login": intencion_login,
+    "saludo": intencion_saludo,
+    "contacto": intencion_contacto,
+    "novedades": intencion_novedades,
+    "buscar": intencion_buscar,
+    "stock": intencion_stock,
+    "ver_carrito": intencion_ver_carrito,
+    "vaciar": intencion_vaciar,
+    "historial": intencion_historial,
+    "mas_pedidos": intencion_mas_pedidos,
+    "mi_pedido": intencion_mi_pedido,
+    "catalogo": intencion_catalogo,
+    "categoria": intencion_categoria,
+    "siguiente": intencion_siguiente,
+    "agregar": intencion_agregar,
+    "salir": intencion_salir,
+    "pedido_id": intencion_pedido_id,
+    "finalizar": intencion_finalizar,
+}
+
+# Comandos que, escritos mientras se navega una categoría, salen de ella antes de atenderse
+SALEN_DE_CATEGORIA = {"saludo", "catalogo", "registrar", "login"}
+
+def manejar_mensaje(sender_id, msg):
+    # Recuperamos el estado actual. Si no existe, es "inicio".
+    estado = user_state.get(sender_id, {}).get("estado", "inicio")
+    intencion, dato = router_intenciones.clasificar(msg, estado)
+    if estado == "viendo_cat" and intencion in SALEN_DE_CATEGORIA:
+        fin_de_flujo(sender_id)
+    if intencion is None:
+        # --- IA POR DEFECTO ---
+        return consultar_ia(sender_id, msg)
+    return MANEJADORES[intencion](sender_id, msg, dato)
 
 # ==========================================
 # 7. ENDPOINTS FLASK
@@ -685,31 +680,96 @@ def verify():
     if request.args.get("hub.verify_token") == VERIFY_TOKEN: return request.args.get("hub.challenge")
     return "Error de validación", 403
 
+def procesar_evento(event):
+    sender_id = event["sender"]["id"]
+    text = event["message"].get("text", "")
+
+    if verificar_rate_limit(sender_id):
+        text = sanitizar_input(text)
+        msg_norm = normalizar(text)
+
+        lease = tomar_estado_usuario(sender_id)
+        try:
+            resp = manejar_mensaje(sender_id, msg_norm)
+            if resp:
+                enviar_mensaje(sender_id, resp)
+
+            guardar_sesion(sender_id)
+        finally:
+            liberar_estado_usuario(sender_id, lease)
+
+cola_eventos = ColaEventos(procesar_evento)
+atexit.register(cola_eventos.detener)
+# Reintentos de Facebook (mismo mid): se descartan antes del rate limit y de la cola
+deduplicador = DeduplicadorEventos(estado=estado_compartido)
+
+def precalentar_catalogo():
+    if not obtener_productos_con_cache():
+        raise RuntimeError("el catálogo sigue vacío")
+
+def precalentar_imagenes():
+    validador_imagenes.programar([p.imagen_url for p in obtener_productos_con_cache().values()])
+    if not validador_imagenes.esperar(ARRANQUE_ESPERA_IMAGENES):
+        print(f"⚠️ Arranque: la validación de imágenes sigue en curso tras {ARRANQUE_ESPERA_IMAGENES:.0f} s")
+
+# El servidor acepta peticiones desde ya; estas cargas corren en un hilo aparte
+arranque = Arranque()
+arranque.paso("firebase", obtener_db, obligatorio=True)
+arranque.paso("catalogo", precalentar_catalogo, obligatorio=True)
+arranque.paso("indice", obtener_indice_productos)
+arranque.paso("vista_catalogo", obtener_vista_catalogo)
+arranque.paso("imagenes", precalentar_imagenes)
+arranque.paso("cliente_ia", lambda: cliente_ia.cliente)
+if indice_semantico: arranque.paso("embeddings", indice_semantico.cargar_modelo)
+arranque.iniciar()
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
-    data = request.get_json()
+    # Solo se encolan los eventos; los workers responden al usuario en segundo plano
+    data = request.get_json(silent=True) or {}
+    rechazados = 0
     if data.get("object") == "page":
         for entry in data.get("entry", []):
             for event in entry.get("messaging", []):
                 if "message" in event and not event["message"].get("is_echo"):
-                    sender_id = event["sender"]["id"]
-                    text = event["message"].get("text", "")
-                    
-                    if verificar_rate_limit(sender_id):
-                        text = sanitizar_input(text)
-                        msg_norm = normalizar(text)
-                        
-                        if sender_id not in user_state:
-                            s = cargar_sesion(sender_id)
-                            if s: user_state[sender_id] = s
-                        
-                        resp = manejar_mensaje(sender_id, msg_norm)
-                        if resp:
-                            enviar_mensaje(sender_id, resp)
-                        
-                        guardar_sesion(sender_id)
+                    mid = event["message"].get("mid")
+                    if not deduplicador.es_nuevo(mid):
+                        continue
+                    if not cola_eventos.encolar(event["sender"]["id"], event):
+                        deduplicador.olvidar(mid)
+                        rechazados += 1
+    if rechazados and cola_eventos.politica_llena == "rechazar":
+        return "Cola llena", 503
     return "OK", 200
 
+@app.route("/salud", methods=["GET"])
+def salud():
+    # Liveness: el proceso responde, aunque siga precalentando
+    return jsonify({"vivo": True}), 200
+
+@app.route("/listo", methods=["GET"])
+def listo():
+    # Readiness: 503 hasta que el catálogo y sus índices están cargados en este worker
+    arranque.iniciar()
+    return jsonify(arranque.metricas()), (200 if arranque.listo() else 503)
+
+@app.route("/metricas", methods=["GET"])
+def metricas():
+    return jsonify({
+        "arranque": arranque.metricas(),
+        "cola_eventos": cola_eventos.metricas(),
+        "catalogo": catalogo.metricas(),
+        "deduplicacion": deduplicador.metricas(),
+        "envio_facebook": enviador.metricas(),
+        "imagenes": validador_imagenes.metricas(),
+        "sesiones": sesiones.metricas(),
+        "estado": estado_compartido.metricas(),
+        "rate_limit": limitador_mensajes.metricas(),
+        "rate_limit_envio": enviador.limitador.metricas(),
+        "ia": cliente_ia.metricas(),
+        "cache_ia": cache_ia.metricas()
+    })
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
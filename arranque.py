@@ -0,0 +1,142 @@
+# arranque.py
+import os
+import threading
+import time
+
+# Configuración (variables de entorno)
+# Segundos máximos que el precalentamiento espera a la validación de imágenes
+ARRANQUE_ESPERA_IMAGENES = float(os.environ.get("ARRANQUE_ESPERA_IMAGENES", 20))
+# Segundos entre intentos cuando falla un paso obligatorio (Firebase, catálogo)
+ARRANQUE_REINTENTO = float(os.environ.get("ARRANQUE_REINTENTO", 10))
+
+
+class Arranque:
+    """
+    Precalentamiento en segundo plano: el servidor acepta peticiones en cuanto
+    se importa app.py y este hilo va creando clientes y cargando el catálogo,
+    sus índices y la validación de imágenes, para que el primer mensaje no
+    pague esas cargas.
+
+    El worker se reporta listo (/listo) cuando terminaron todos los pasos y
+    los obligatorios salieron bien; si uno obligatorio falla se reintenta la
+    secuencia cada ARRANQUE_REINTENTO segundos. /salud solo dice que el
+    proceso está vivo.
+    """
+
+    def __init__(self, reintento=ARRANQUE_REINTENTO):
+        self.reintento = reintento
+        self._inicio = time.monotonic()
+        self._pasos = []  # (nombre, funcion, obligatorio)
+        self._resultados = {}  # nombre -> {"ms": duración, "error": texto o None}
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+        self._listo_en = None
+        self._intentos = 0
+        self._pid = None
+
+    def paso(self, nombre, funcion, obligatorio=False):
+        self._pasos.append((nombre, funcion, obligatorio))
+
+    def iniciar(self):
+        """Arranca el hilo de precalentamiento una vez por proceso (también tras un fork de gunicorn)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._ejecutar, name="arranque", daemon=True).start()
+
+    def _ejecutar(self):
+        while True:
+            self._intentos += 1
+            completo = True
+            for nombre, funcion, obligatorio in self._pasos:
+                inicio = time.monotonic()
+                error = None
+                try:
+                    funcion()
+                except Exception as e:
+                    error = f"{type(e).__name__} - {e}"
+                    print(f"⚠️ Arranque: falló '{nombre}': {error}")
+                    if obligatorio:
+                        completo = False
+                with self._lock:
+                    self._resultados[nombre] = {"ms": round(1000 * (time.monotonic() - inicio), 1), "error": error}
+                if not completo:
+                    break
+            if completo:
+                break
+            time.sleep(self.reintento)
+        self._listo_en = time.monotonic() - self._inicio
+        self._listo.set()
+        print(f"✅ Arranque listo en {self._listo_en:.2f} s")
+
+    def listo(self):
+        return self._listo.is_set()
+
+    def esperar(self, timeout=None):
+        return self._listo.wait(timeout)
+
+    def metricas(self):
+        with self._lock:
+            return {
+                "listo": self._listo.is_set(),
+                "vivo_s": round(time.monotonic() - self._inicio, 1),
+                "listo_en_s": round(self._listo_en, 2) if self._listo_en is not None else None,
+                "intentos": self._intentos,
+                "pasos": dict(self._resultados),
+            }
+
+
+# ==========================================
+# BENCHMARK: tiempo de arranque del servidor
+# ==========================================
+# Uso: python arranque.py [repeticiones]
+# Cada medición corre en un proceso nuevo: cuánto tardan en importarse las
+# dependencias pesadas que ahora se cargan en diferido, cuánto tarda
+# 'import app' (a partir de ahí el servidor ya acepta peticiones) y cuánto
+# hasta que el precalentamiento reporta listo. Necesita las mismas variables
+# de entorno que el servidor.
+if __name__ == "__main__":
+    import json
+    import statistics
+    import subprocess
+    import sys
+
+    REPETICIONES = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    directorio = os.path.dirname(os.path.abspath(__file__))
+
+    def medir_en_proceso(codigo):
+        salida = subprocess.run([sys.executable, "-c", codigo], cwd=directorio,
+                                capture_output=True, text=True, timeout=300)
+        if salida.returncode != 0:
+            raise RuntimeError(salida.stderr.strip().splitlines()[-1])
+        return json.loads(salida.stdout.strip().splitlines()[-1])
+
+    def importar(modulo):
+        return (f"import json, time\nt = time.perf_counter()\nimport {modulo}\n"
+                f"print(json.dumps({{'s': time.perf_counter() - t}}))")
+
+    servidor = ("import json, time\nt = time.perf_counter()\nimport app\n"
+                "importado = time.perf_counter() - t\napp.arranque.esperar(300)\n"
+                "print(json.dumps({'importado': importado, 'listo': time.perf_counter() - t,"
+                " 'pasos': app.arranque.metricas()['pasos']}))")
+
+    def resumen(nombre, valores):
+        print(f"{nombre:>34}: mediana {1000 * statistics.median(valores):8.1f} ms, "
+              f"máx {1000 * max(valores):8.1f} ms")
+
+    for modulo in ("firebase_admin.firestore", "huggingface_hub"):
+        try:
+            resumen(f"import {modulo} (diferido)", [medir_en_proceso(importar(modulo))["s"] for _ in range(REPETICIONES)])
+        except Exception as e:
+            print(f"{'import ' + modulo:>34}: no disponible ({e})")
+
+    try:
+        corridas = [medir_en_proceso(servidor) for _ in range(REPETICIONES)]
+    except Exception as e:
+        print(f"No se pudo arrancar app: {e}")
+        sys.exit(1)
+    resumen("import app (acepta peticiones)", [c["importado"] for c in corridas])
+    resumen("precalentamiento listo", [c["listo"] for c in corridas])
+    for nombre in corridas[-1]["pasos"]:
+        resumen(f"  paso {nombre}", [c["pasos"][nombre]["ms"] / 1000 for c in corridas])
@@ -0,0 +1,87 @@
+# cache_respuestas.py
+import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from recuperacion import raiz, PALABRAS_VACIAS
+
+# Configuración (variables de entorno)
+CACHE_IA_MAX = int(os.environ.get("CACHE_IA_MAX", 2000))
+CACHE_IA_TTL = int(os.environ.get("CACHE_IA_TTL", 3600))
+# Reutilizar la respuesta de una pregunta que solo cambia en plurales o palabras vacías (0 lo desactiva)
+CACHE_IA_SIMILARES = os.environ.get("CACHE_IA_SIMILARES", "1") == "1"
+
+
+def clave_similar(pregunta):
+    """Raíces de las palabras con contenido (las mismas que usa la recuperación): iguales = misma pregunta."""
+    # A diferencia de la recuperación se conservan las palabras cortas: "talla m" y "talla l" difieren
+    return frozenset(raiz(p) for p in pregunta.split() if p not in PALABRAS_VACIAS)
+
+
+def huella_contexto(contexto):
+    """Huella del contexto de productos: si cambia un precio o el stock, cambia la clave."""
+    return hashlib.blake2b(contexto.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class CacheRespuestas:
+    """
+    Caché LRU con TTL de respuestas de la IA. La clave es la pregunta
+    normalizada más la huella del contexto de productos recuperado, así que
+    una respuesta nunca sobrevive a un cambio en los datos que la generaron.
+    Con similares=True también reutiliza la respuesta de una pregunta con el
+    mismo contexto cuyas palabras con contenido son exactamente las mismas
+    salvo plurales ("tienen camisas blancas" / "tienen la camisa blanca");
+    "talla m" y "talla l" siguen siendo preguntas distintas.
+    """
+
+    def __init__(self, max_entradas=CACHE_IA_MAX, ttl=CACHE_IA_TTL, similares=CACHE_IA_SIMILARES):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.similares = similares
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # (huella, pregunta) -> (respuesta, expira_en, clave_similar)
+        self._similares = {}            # (huella, clave_similar) -> pregunta guardada más reciente
+        self._contadores = {"aciertos": 0, "aciertos_similares": 0, "fallos": 0, "guardadas": 0}
+
+    @staticmethod
+    def _pregunta(mensaje):
+        return " ".join(mensaje.split())
+
+    def obtener(self, mensaje, huella):
+        pregunta = self._pregunta(mensaje)
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get((huella, pregunta))
+            if entrada is not None and ahora < entrada[1]:
+                self._entradas.move_to_end((huella, pregunta))
+                self._contadores["aciertos"] += 1
+                return entrada[0]
+            if self.similares:
+                clave = clave_similar(pregunta)
+                otra = self._similares.get((huella, clave)) if clave else None
+                if otra is not None and ahora < self._entradas[(huella, otra)][1]:
+                    self._entradas.move_to_end((huella, otra))
+                    self._contadores["aciertos_similares"] += 1
+                    return self._entradas[(huella, otra)][0]
+            self._contadores["fallos"] += 1
+            return None
+
+    def guardar(self, mensaje, huella, respuesta):
+        pregunta = self._pregunta(mensaje)
+        clave = clave_similar(pregunta)
+        with self._lock:
+            self._entradas[(huella, pregunta)] = (respuesta, time.monotonic() + self.ttl, clave)
+            self._entradas.move_to_end((huella, pregunta))
+            if clave:
+                self._similares[(huella, clave)] = pregunta
+            self._contadores["guardadas"] += 1
+            while len(self._entradas) > self.max_entradas:
+                (h, p), (_, _, c) = self._entradas.popitem(last=False)
+                if self._similares.get((h, c)) == p:
+                    del self._similares[(h, c)]
+
+    def metricas(self):
+        with self._lock:
+            return {**self._contadores, "entradas": len(self._entradas)}
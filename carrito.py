@@ -0,0 +1,73 @@
+# carrito.py
+from producto import leer_precio
+
+
+class LineaCarrito:
+    __slots__ = ("nombre", "precio", "cantidad")
+
+    def __init__(self, nombre, precio, cantidad):
+        self.nombre = nombre
+        self.precio = precio
+        self.cantidad = cantidad
+
+    @property
+    def subtotal(self):
+        return self.precio * self.cantidad
+
+
+class Carrito:
+    """
+    Carrito indexado por ID de producto: agregar el mismo producto otra vez
+    suma cantidad en lugar de crear otra línea. El precio se guarda ya
+    numérico al agregar y el total se mantiene al día en cada cambio.
+
+    En la sesión se guarda como {pid: [nombre, precio, cantidad]}
+    (ver a_dict / desde_sesion).
+    """
+
+    __slots__ = ("_lineas", "total")
+
+    def __init__(self):
+        self._lineas = {}
+        self.total = 0.0
+
+    def agregar(self, pid, nombre, precio, cantidad=1):
+        precio = leer_precio(precio)
+        linea = self._lineas.get(pid)
+        if linea is None:
+            self._lineas[pid] = LineaCarrito(nombre, precio, cantidad)
+        else:
+            # Se conserva el precio con el que se agregó la primera vez
+            linea.cantidad += cantidad
+        self.total += self._lineas[pid].precio * cantidad
+
+    def cantidades(self):
+        return {pid: linea.cantidad for pid, linea in self._lineas.items()}
+
+    def __iter__(self):
+        return iter(self._lineas.items())
+
+    def __len__(self):
+        return len(self._lineas)
+
+    def a_dict(self):
+        return {pid: [l.nombre, l.precio, l.cantidad] for pid, l in self._lineas.items()}
+
+    @classmethod
+    def desde_sesion(cls, datos):
+        """Reconstruye el carrito guardado; acepta también el formato antiguo (lista de dicts)."""
+        carrito = cls()
+        if isinstance(datos, dict):
+            for pid, (nombre, precio, cantidad) in datos.items():
+                carrito.agregar(pid, nombre, precio, cantidad)
+        elif isinstance(datos, list):
+            for item in datos:
+                pid = item.get("id")
+                if not pid or pid == "CATALOGO" or not item.get("nombre"):
+                    continue
+                try:
+                    cantidad = int(item.get("cantidad", 1))
+                except (TypeError, ValueError):
+                    continue
+                carrito.agregar(pid, item["nombre"], item.get("precio", 0), cantidad)
+        return carrito
@@ -0,0 +1,292 @@
+# catalogo.py
+import os
+import threading
+import time
+
+from conexion_firebase import db
+from normalizacion import normalizar, normalizar_memo
+from producto import Producto, productos_desde_firestore
+
+# Configuración (variables de entorno)
+CATALOGO_TIEMPO_REAL = os.environ.get("CATALOGO_TIEMPO_REAL", "1") == "1"
+CATALOGO_TTL = int(os.environ.get("CATALOGO_TTL", 300))
+# Segundos que se espera el primer snapshot antes de recurrir a una lectura completa
+CATALOGO_ESPERA_INICIAL = float(os.environ.get("CATALOGO_ESPERA_INICIAL", 10))
+# Segundos sin volver a intentar una lectura completa después de que una falló
+CATALOGO_REINTENTO = float(os.environ.get("CATALOGO_REINTENTO", 15))
+
+
+class CatalogoEnVivo:
+    """
+    Catálogo de productos {pid: Producto} compartido por todo el proceso, al día
+    con un listener on_snapshot de Firestore (o lecturas completas con TTL).
+    """
+
+    def __init__(self, coleccion="productos", tiempo_real=CATALOGO_TIEMPO_REAL, ttl=CATALOGO_TTL, estado=None):
+        self.coleccion = coleccion
+        self.estado = estado
+        self.tiempo_real = tiempo_real
+        self.ttl = ttl
+        self.version = 0
+        self._datos = {}
+        self._cargado_en = None
+        self._lock = threading.Lock()
+        self._primer_snapshot = threading.Event()
+        self._watch = None
+        self._pid = None
+        self._suscriptores = []
+        self._derivados = {}  # nombre -> (diccionario de productos del que sale, estructura)
+        self._locks_derivados = {}
+        self._lock_recarga = threading.Lock()
+        self._revalidando = False
+        self._fallo_en = None
+        self._suscripcion_fallida_en = None
+        self._ultimo_error = None
+        self._duracion_ultima = None
+        self._contadores = {"recargas": 0, "recargas_fallidas": 0, "revalidaciones": 0,
+                            "servidos_vencidos": 0, "snapshots": 0}
+
+    def suscribir(self, callback):
+        """callback(productos, ids_cambiados) se llama tras cada actualización."""
+        self._suscriptores.append(callback)
+
+    # --- Lectura ---
+    def productos(self):
+        if self.tiempo_real:
+            self._asegurar_listener()
+        elif self._vencido():
+            self._refrescar()
+        return self._datos
+
+    def derivado(self, nombre, construir):
+        """Estructura construir(productos) cacheada hasta la siguiente versión del catálogo."""
+        prods = self.productos()
+        actual = self._derivados.get(nombre)
+        if actual is not None and actual[0] is prods:
+            return actual[1]
+        lock = self._locks_derivados.setdefault(nombre, threading.Lock())
+        if not lock.acquire(blocking=actual is None):
+            # Otro hilo la está reconstruyendo: mientras tanto sirve la de la versión anterior
+            return actual[1]
+        try:
+            actual = self._derivados.get(nombre)
+            if actual is None or actual[0] is not prods:
+                actual = (prods, construir(prods))
+                self._derivados[nombre] = actual
+            return actual[1]
+        finally:
+            lock.release()
+
+    def vista(self):
+        return self.derivado("vista", VistaCatalogo)
+
+    def _vencido(self):
+        return self._cargado_en is None or time.monotonic() - self._cargado_en >= self.ttl
+
+    def invalidar(self):
+        """Solo tiene efecto sin listener activo: fuerza la recarga en la próxima lectura."""
+        if not self._listener_activo():
+            self._cargado_en = None
+            if self.estado is not None:
+                self.estado.borrar("catalogo", self.coleccion)
+
+    def _refrescar(self):
+        """Sin datos o tras invalidar espera la carga; con datos vencidos responde con ellos y revalida en segundo plano."""
+        if not self._datos or self._cargado_en is None:
+            self.recargar()
+            return
+        with self._lock:
+            self._contadores["servidos_vencidos"] += 1
+            if self._revalidando:
+                return
+            self._revalidando = True
+            self._contadores["revalidaciones"] += 1
+        threading.Thread(target=self._revalidar, name="catalogo-revalidacion", daemon=True).start()
+
+    def _revalidar(self):
+        try:
+            self.recargar()
+        finally:
+            self._revalidando = False
+
+    # --- Carga completa ---
+    def recargar(self):
+        """Lectura completa de un solo vuelo: quien llega durante otra carga espera su resultado."""
+        # Una carga fallida no se publica ni se cachea: se conservan los datos anteriores
+        version = self.version
+        with self._lock_recarga:
+            if self.version != version:
+                return  # Otro hilo cargó mientras esperábamos
+            if self._fallo_en is not None and time.monotonic() - self._fallo_en < CATALOGO_REINTENTO:
+                return  # Falló hace poco: no se insiste contra Firestore
+            inicio = time.monotonic()
+            try:
+                crudos = self._leer_completo()
+            except Exception as e:
+                with self._lock:
+                    self._contadores["recargas_fallidas"] += 1
+                    self._fallo_en = time.monotonic()
+                    self._ultimo_error = f"{type(e).__name__} - {e}"
+                print(f"🔥 Error al cargar el catálogo: {self._ultimo_error}")
+                return
+            productos = productos_desde_firestore(crudos)
+            self._fallo_en = None
+            self._duracion_ultima = time.monotonic() - inicio
+            with self._lock:
+                self._contadores["recargas"] += 1
+            self._publicar(productos, set(productos) | set(self._datos))
+
+    def _leer_completo(self):
+        # Lanza excepción si Firestore falla, para no confundir un error con un catálogo vacío.
+        # Con estado compartido (Redis) la lectura se publica ahí y los demás workers la reutilizan
+        compartir = self.estado is not None and self.estado.compartido
+        if compartir:
+            compartido = self.estado.obtener("catalogo", self.coleccion)
+            if compartido:
+                return compartido
+        crudos = {doc.id: doc.to_dict() for doc in db.collection(self.coleccion).stream()}
+        if not crudos and self._datos:
+            raise ValueError("la colección llegó vacía; se conservan los datos anteriores")
+        print(f"✅ Se obtuvieron {len(crudos)} productos de Firebase")
+        if compartir and crudos:
+            self.estado.guardar("catalogo", self.coleccion, crudos, ttl=self.ttl)
+        return crudos
+
+    def _publicar(self, productos, cambiados):
+        # Copy-on-write: el diccionario publicado nunca se modifica, cada cambio lo reemplaza
+        with self._lock:
+            self._datos = productos
+            self._cargado_en = time.monotonic()
+            self.version += 1
+        for callback in self._suscriptores:
+            try:
+                callback(productos, cambiados)
+            except Exception as e:
+                print(f"🔥 Error en suscriptor del catálogo: {type(e).__name__} - {e}")
+
+    # --- Listener en tiempo real ---
+    def _listener_activo(self):
+        return (self._watch is not None and self._pid == os.getpid()
+                and getattr(self._watch, "is_active", True))
+
+    def _asegurar_listener(self):
+        # Cada snapshot trae solo los documentos cambiados; la lectura completa solo ocurre
+        # con el primer snapshot o al volver a suscribirse
+        if self._listener_activo():
+            return
+        with self._lock:
+            if self._listener_activo():
+                return
+            if self._watch is not None:
+                print("⚠️ Listener del catálogo caído, volviendo a suscribir")
+                try:
+                    self._watch.unsubscribe()
+                except Exception:
+                    pass
+                self._watch = None
+            ahora = time.monotonic()
+            # Tras un fallo no se reintenta en cada lectura, solo cada CATALOGO_REINTENTO segundos
+            if self._suscripcion_fallida_en is None or ahora - self._suscripcion_fallida_en >= CATALOGO_REINTENTO:
+                self._primer_snapshot.clear()
+                try:
+                    self._watch = db.collection(self.coleccion).on_snapshot(self._al_cambiar)
+                    self._pid = os.getpid()
+                    self._suscripcion_fallida_en = None
+                except Exception as e:
+                    print(f"🔥 Error al suscribir el catálogo: {type(e).__name__} - {e}")
+                    self._watch = None
+                    self._suscripcion_fallida_en = ahora
+        if self._watch is None:
+            # Sin listener, al menos una lectura completa vigente
+            if self._vencido():
+                self._refrescar()
+            return
+        if not self._datos and not self._primer_snapshot.wait(CATALOGO_ESPERA_INICIAL):
+            print("⚠️ El primer snapshot del catálogo tarda demasiado, leyendo colección completa")
+            self.recargar()
+
+    def _al_cambiar(self, docs, cambios, read_time):
+        # Se ejecuta en el hilo del listener de Firestore
+        try:
+            if not self._primer_snapshot.is_set():
+                # Primer snapshot tras suscribirse: trae la colección completa
+                productos = {doc.id: Producto.desde_firestore(doc.id, doc.to_dict()) for doc in docs}
+                self._publicar(productos, set(productos) | set(self._datos))
+                print(f"✅ Catálogo cargado por snapshot: {len(productos)} productos")
+                return
+            productos = dict(self._datos)
+            cambiados = set()
+            for cambio in cambios:
+                doc = cambio.document
+                if cambio.type.name == "REMOVED":
+                    productos.pop(doc.id, None)
+                else:
+                    productos[doc.id] = Producto.desde_firestore(doc.id, doc.to_dict())
+                cambiados.add(doc.id)
+            if cambiados:
+                with self._lock:
+                    self._contadores["snapshots"] += 1
+                self._publicar(productos, cambiados)
+                print(f"🔄 Catálogo actualizado: {len(cambiados)} cambios (versión {self.version})")
+        finally:
+            self._primer_snapshot.set()
+
+
+    def metricas(self):
+        with self._lock:
+            return {
+                **self._contadores,
+                "modo": "tiempo_real" if self.tiempo_real else "ttl",
+                "listener_activo": self._listener_activo(),
+                "version": self.version,
+                "productos": len(self._datos),
+                "edad_s": round(time.monotonic() - self._cargado_en, 1) if self._cargado_en is not None else None,
+                "ultima_recarga_ms": round(1000 * self._duracion_ultima, 1) if self._duracion_ultima is not None else None,
+                "revalidando": self._revalidando,
+                "ultimo_error": self._ultimo_error,
+            }
+
+
+class VistaCatalogo:
+    """
+    Vista de solo lectura construida una vez por versión del catálogo:
+    categoría normalizada -> IDs de sus productos (en orden del catálogo),
+    nombre visible y conteo de cada categoría, y las listas de ofertas y
+    novedades. Evita recorrer y normalizar todo el catálogo en cada mensaje.
+    """
+
+    def __init__(self, productos, normalizar=normalizar):
+        self.productos = productos
+        self.nombres = {}         # categoría normalizada -> nombre tal como está en Firestore
+        self.por_categoria = {}   # categoría normalizada -> (pid, ...)
+        ofertas = []
+        for pid, p in productos.items():
+            c_raw = p.categoria or "Varios"
+            c = p.norm_categoria if p.categoria else normalizar_memo(c_raw)
+            self.nombres.setdefault(c, c_raw)
+            self.por_categoria.setdefault(c, []).append(pid)
+            if p.oferta:
+                ofertas.append(pid)
+        self.por_categoria = {c: tuple(ids) for c, ids in self.por_categoria.items()}
+        self.conteos = {c: len(ids) for c, ids in self.por_categoria.items()}
+        self.ofertas = tuple(ofertas)
+        self.novedades = tuple(productos)
+
+    def categoria(self, msg):
+        """Devuelve la categoría normalizada si el mensaje es exactamente una categoría."""
+        return msg if msg in self.por_categoria else None
+
+
+_compartido = None
+_lock_compartido = threading.Lock()
+
+
+def catalogo_compartido(estado=None):
+    """Instancia única del catálogo en el proceso; app.py la crea con su backend de estado."""
+    global _compartido
+    with _lock_compartido:
+        if _compartido is None:
+            _compartido = CatalogoEnVivo(estado=estado)
+        elif estado is not None and _compartido.estado is None:
+            _compartido.estado = estado
+        return _compartido
@@ -0,0 +1,118 @@
+# checkout.py
+import os
+import time
+from datetime import datetime
+
+from conexion_firebase import db
+from producto import leer_precio, leer_stock
+from historial_pedidos import ref_resumen, escribir_resumen
+
+# Intentos de la transacción cuando otra compra toca los mismos productos
+CHECKOUT_INTENTOS = int(os.environ.get("CHECKOUT_INTENTOS", 5))
+
+
+class StockInsuficiente(Exception):
+    """Alguno de los productos no alcanza; faltantes trae un texto por producto."""
+
+    def __init__(self, faltantes):
+        super().__init__(", ".join(faltantes))
+        self.faltantes = faltantes
+
+
+def _campo_stock(datos, nuevo):
+    # Se respeta el formato con el que está guardado el producto
+    if isinstance(datos.get("stock"), dict):
+        return {"stock.Piezas": nuevo}
+    return {"stock": nuevo}
+
+
+def crear_pedido_atomico(cantidades, datos_pedido, coleccion_productos="productos", coleccion_pedidos="pedidos",
+                         intentos=CHECKOUT_INTENTOS, precios=None):
+    """
+    Valida stock, lo descuenta y crea el pedido en una sola transacción de
+    Firestore: una lectura por lotes de todos los productos y un commit con
+    todas las escrituras (incluido el resumen de pedidos del usuario, ver
+    historial_pedidos). Firestore reintenta la transacción si otra compra
+    modificó los mismos productos. Con precios ({pid: precio}, los del
+    carrito) se cobra lo que vio el cliente; si no, el precio actual.
+    Devuelve (pedido_id, total, items).
+    """
+    refs = {pid: db.collection(coleccion_productos).document(pid) for pid in cantidades}
+    pedido_ref = db.collection(coleccion_pedidos).document()
+    resumen_ref = ref_resumen(datos_pedido["telefono"]) if datos_pedido.get("telefono") else None
+    a_leer = list(refs.values()) + ([resumen_ref] if resumen_ref is not None else [])
+    from firebase_admin import firestore  # Ya cargado por obtener_db al crear las referencias
+
+    @firestore.transactional
+    def _ejecutar(transaction):
+        docs = {doc.reference.path: doc for doc in db.get_all(a_leer, transaction=transaction)}
+        items, faltantes = [], []
+        for pid, cantidad in cantidades.items():
+            doc = docs.get(refs[pid].path)
+            if doc is None or not doc.exists:
+                faltantes.append(f"{pid} (no existe)")
+                continue
+            d = doc.to_dict()
+            stock = leer_stock(d)
+            if stock < cantidad:
+                faltantes.append(f"{d.get('nombre', pid)} (solo hay {stock})")
+                continue
+            items.append((pid, d, stock, cantidad))
+        if faltantes:
+            raise StockInsuficiente(faltantes)
+
+        precios_pedido = precios or {}
+        productos = [{"id": pid, "nombre": d.get("nombre"), "cantidad": cantidad,
+                      "precio": precios_pedido[pid] if pid in precios_pedido else leer_precio(d.get("precio"))}
+                     for pid, d, _, cantidad in items]
+        total = sum(p["precio"] * p["cantidad"] for p in productos)
+        for pid, d, stock, cantidad in items:
+            transaction.update(refs[pid], _campo_stock(d, stock - cantidad))
+        pedido = {**datos_pedido, "productos": productos, "total": total}
+        transaction.set(pedido_ref, pedido)
+        if resumen_ref is not None:
+            escribir_resumen(transaction, docs.get(resumen_ref.path), pedido_ref.id, pedido)
+        return total, productos
+
+    total, productos = _ejecutar(db.transaction(max_attempts=intentos))
+    return pedido_ref.id, total, productos
+
+
+# ==========================================
+# BENCHMARK: latencia del checkout vs tamaño del carrito
+# ==========================================
+# Uso (mejor contra el emulador: FIRESTORE_EMULATOR_HOST=localhost:8080):
+#   python checkout.py
+if __name__ == "__main__":
+    import statistics
+
+    COL_PRODUCTOS, COL_PEDIDOS = "bench_productos", "bench_pedidos"
+    TAMANOS = [1, 2, 5, 10, 20]
+    REPETICIONES = 5
+
+    batch = db.batch()
+    for i in range(max(TAMANOS)):
+        batch.set(db.collection(COL_PRODUCTOS).document(f"B{i}"), {"nombre": f"Bench {i}", "precio": 10, "stock": 10 ** 6})
+    batch.commit()
+
+    def checkout_anterior(cantidades):
+        # Flujo previo: lectura + update por producto y el pedido aparte (N+1 viajes, sin transacción)
+        for pid in cantidades:
+            db.collection(COL_PRODUCTOS).document(pid).get()
+        db.collection(COL_PEDIDOS).add({"fecha": datetime.now()})
+        for pid, cantidad in cantidades.items():
+            ref = db.collection(COL_PRODUCTOS).document(pid)
+            ref.update({"stock": leer_stock(ref.get().to_dict()) - cantidad})
+
+    print(f"{'productos':>9} | {'transacción (ms)':>16} | {'anterior (ms)':>13}")
+    for n in TAMANOS:
+        cantidades = {f"B{i}": 1 for i in range(n)}
+        tiempos = {"nuevo": [], "anterior": []}
+        for _ in range(REPETICIONES):
+            t = time.perf_counter()
+            crear_pedido_atomico(cantidades, {"fecha": datetime.now()}, COL_PRODUCTOS, COL_PEDIDOS)
+            tiempos["nuevo"].append(time.perf_counter() - t)
+            t = time.perf_counter()
+            checkout_anterior(cantidades)
+            tiempos["anterior"].append(time.perf_counter() - t)
+        print(f"{n:>9} | {1000 * statistics.median(tiempos['nuevo']):>16.1f} | {1000 * statistics.median(tiempos['anterior']):>13.1f}")
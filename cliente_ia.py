@@ -0,0 +1,116 @@
+# cliente_ia.py
+import os
+import queue
+import threading
+import time
+
+# Configuración (variables de entorno)
+IA_MODELO = os.environ.get("IA_MODELO", "Qwen/Qwen2.5-7B-Instruct")
+# Segundos máximos hasta el primer token y para la respuesta completa
+IA_TTFT = float(os.environ.get("IA_TTFT", 4))
+IA_DEADLINE = float(os.environ.get("IA_DEADLINE", 12))
+
+_FIN = object()
+
+
+class ClienteIA:
+    """
+    Envoltura reutilizable de InferenceClient que pide la respuesta en
+    streaming y la corta si se pasa del presupuesto de latencia. Devuelve
+    None cuando no hay una respuesta utilizable a tiempo, para que el bot
+    responda con su alternativa sin IA.
+    """
+
+    def __init__(self, token, modelo=IA_MODELO, ttft=IA_TTFT, deadline=IA_DEADLINE):
+        self.token = token
+        self.modelo = modelo
+        self.ttft = ttft
+        self.deadline = deadline
+        self._cliente = None
+        self._lock = threading.Lock()
+        self._contadores = {"llamadas": 0, "con_token": 0, "completas": 0,
+                            "parciales": 0, "ttft_excedido": 0, "errores": 0}
+        self._ttft_total = 0.0
+
+    @property
+    def cliente(self):
+        if self._cliente is None:
+            # huggingface_hub se importa aquí, en la primera consulta, y no al arrancar
+            from huggingface_hub import InferenceClient
+            self._cliente = InferenceClient(token=self.token, timeout=self.deadline)
+        return self._cliente
+
+    def _contar(self, clave, ttft=None):
+        with self._lock:
+            self._contadores[clave] += 1
+            if ttft is not None:
+                self._ttft_total += ttft
+
+    def _producir(self, salida, cancelado, **kwargs):
+        # Corre en un hilo aparte: empuja cada fragmento a la cola hasta terminar o ser cancelado
+        try:
+            for chunk in self.cliente.chat_completion(stream=True, **kwargs):
+                if cancelado.is_set():
+                    break
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    salida.put(delta)
+        except Exception as e:
+            salida.put(e)
+        finally:
+            salida.put(_FIN)
+
+    def generar(self, messages, max_tokens=200, temperature=0.4):
+        """Devuelve (texto, completa); completa=False si se cortó por tiempo o por error."""
+        self._contar("llamadas")
+        inicio = time.monotonic()
+        salida, cancelado = queue.Queue(), threading.Event()
+        threading.Thread(target=self._producir, args=(salida, cancelado), daemon=True, kwargs={
+            "messages": messages, "model": self.modelo,
+            "max_tokens": max_tokens, "temperature": temperature,
+        }).start()
+
+        partes = []
+        limite = inicio + self.ttft
+        try:
+            while True:
+                restante = limite - time.monotonic()
+                try:
+                    item = salida.get(timeout=max(0, restante))
+                except queue.Empty:
+                    if not partes:
+                        self._contar("ttft_excedido")
+                        return None, False
+                    self._contar("parciales")
+                    return _recortar(partes), False
+                if item is _FIN:
+                    break
+                if isinstance(item, Exception):
+                    print(f"Error IA: {type(item).__name__} - {item}")
+                    self._contar("errores")
+                    return (_recortar(partes) if partes else None), False
+                if not partes:
+                    # Llegó el primer token: a partir de aquí rige el límite total
+                    limite = inicio + self.deadline
+                    self._contar("con_token", ttft=time.monotonic() - inicio)
+                partes.append(item)
+        finally:
+            cancelado.set()
+        self._contar("completas")
+        texto = "".join(partes).strip() or None
+        return texto, texto is not None
+
+    def metricas(self):
+        with self._lock:
+            con_token = self._contadores["con_token"]
+            return {**self._contadores,
+                    "ttft_promedio_ms": round(1000 * self._ttft_total / con_token, 1) if con_token > 0 else 0.0}
+
+
+def _recortar(partes):
+    """Respuesta cortada por el límite: se queda hasta la última oración completa."""
+    texto = "".join(partes).strip()
+    corte = max(texto.rfind(c) for c in ".!?\n")
+    if corte >= len(texto) // 2:
+        return texto[:corte + 1].strip()
+    return texto + "…" if texto else None
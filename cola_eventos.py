@@ -0,0 +1,126 @@
+# cola_eventos.py
+import os
+import queue
+import threading
+import time
+import zlib
+
+# Configuración (variables de entorno)
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 4))
+WEBHOOK_COLA_MAX = int(os.environ.get("WEBHOOK_COLA_MAX", 1000))
+# Segundos que el webhook espera por espacio en la cola antes de rechazar el evento
+WEBHOOK_ENCOLAR_TIMEOUT = float(os.environ.get("WEBHOOK_ENCOLAR_TIMEOUT", 0))
+# "rechazar": responde 503 para que Facebook reintente (la deduplicación por mid descarta lo que
+# ya se había encolado) | "descartar": responde 200 y pierde el evento
+WEBHOOK_COLA_LLENA = os.environ.get("WEBHOOK_COLA_LLENA", "rechazar")
+
+_FIN = object()
+
+
+class ColaEventos:
+    """
+    Cola acotada de eventos de Messenger drenada por un pool de workers.
+    Cada remitente se asigna siempre al mismo worker (hash de su sender_id),
+    así sus mensajes se procesan en el orden en que llegaron.
+    """
+
+    def __init__(self, procesar, workers=WEBHOOK_WORKERS, max_eventos=WEBHOOK_COLA_MAX,
+                 timeout_encolar=WEBHOOK_ENCOLAR_TIMEOUT, politica_llena=WEBHOOK_COLA_LLENA):
+        self.procesar = procesar
+        self.workers = max(1, workers)
+        self.max_por_worker = max(1, -(-max_eventos // self.workers))
+        self.timeout_encolar = timeout_encolar
+        self.politica_llena = politica_llena
+        self._lock = threading.Lock()
+        self._pid = None
+        self._colas = []
+        self._hilos = []
+        self._contadores = {"encolados": 0, "procesados": 0, "rechazados": 0, "errores": 0}
+        self._max_profundidad = 0
+        self._espera_total = 0.0
+
+    # --- Ciclo de vida ---
+    def iniciar(self):
+        # Los hilos no sobreviven a un fork (gunicorn), por eso se arrancan por proceso
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._colas = [queue.Queue(maxsize=self.max_por_worker) for _ in range(self.workers)]
+            self._hilos = []
+            for i, cola in enumerate(self._colas):
+                h = threading.Thread(target=self._drenar, args=(cola,), name=f"webhook-worker-{i}", daemon=True)
+                h.start()
+                self._hilos.append(h)
+            self._pid = os.getpid()
+            print(f"✅ Cola de eventos iniciada: {self.workers} workers, {self.max_por_worker} eventos por worker")
+
+    def detener(self, timeout=10):
+        """Espera a que se procesen los eventos pendientes y detiene los workers."""
+        if self._pid != os.getpid():
+            return
+        limite = time.monotonic() + timeout
+        for cola in self._colas:
+            try:
+                cola.put(_FIN, timeout=max(0, limite - time.monotonic()))
+            except queue.Full:
+                pass
+        for h in self._hilos:
+            h.join(max(0, limite - time.monotonic()))
+        self._pid = None
+
+    # --- Productor ---
+    def encolar(self, sender_id, evento):
+        """Devuelve False si la cola del remitente está llena (backpressure)."""
+        self.iniciar()
+        cola = self._colas[zlib.crc32(str(sender_id).encode()) % self.workers]
+        try:
+            if self.timeout_encolar > 0:
+                cola.put((time.monotonic(), evento), timeout=self.timeout_encolar)
+            else:
+                cola.put_nowait((time.monotonic(), evento))
+        except queue.Full:
+            with self._lock:
+                self._contadores["rechazados"] += 1
+            mid = (evento.get("message") or {}).get("mid")
+            destino = "Facebook lo reintentará" if self.politica_llena == "rechazar" else "se descarta"
+            print(f"⚠️ Cola de eventos llena, evento {mid} de {sender_id} rechazado ({destino})")
+            return False
+        with self._lock:
+            self._contadores["encolados"] += 1
+            self._max_profundidad = max(self._max_profundidad, cola.qsize())
+        return True
+
+    # --- Consumidor ---
+    def _drenar(self, cola):
+        while True:
+            item = cola.get()
+            try:
+                if item is _FIN:
+                    return
+                encolado_en, evento = item
+                espera = time.monotonic() - encolado_en
+                try:
+                    self.procesar(evento)
+                    clave = "procesados"
+                except Exception as e:
+                    print(f"🔥 Error procesando evento: {type(e).__name__} - {e}")
+                    clave = "errores"
+                with self._lock:
+                    self._contadores[clave] += 1
+                    self._espera_total += espera
+            finally:
+                cola.task_done()
+
+    # --- Métricas ---
+    def metricas(self):
+        with self._lock:
+            atendidos = self._contadores["procesados"] + self._contadores["errores"]
+            return {
+                **self._contadores,
+                "workers": self.workers,
+                "capacidad": self.max_por_worker * self.workers,
+                "profundidad": sum(c.qsize() for c in self._colas),
+                "profundidad_por_worker": [c.qsize() for c in self._colas],
+                "profundidad_maxima": self._max_profundidad,
+                "espera_promedio_ms": round(1000 * self._espera_total / atendidos, 2) if atendidos else 0.0,
+            }
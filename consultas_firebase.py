@@ -1,21 +1,24 @@
 # consultas_firebase.py
-from conexion_firebase import db
+from catalogo import catalogo_compartido
+
+# Ambas consultas salen del catálogo en memoria (ver catalogo.py) y cachean
+# su resultado hasta que cambia la versión; ya no leen la colección completa.
+
+def _categorias(productos):
+    por_categoria = {}
+    for p in productos.values():
+        categoria = p.categoria.strip()
+        if categoria:
+            por_categoria.setdefault(categoria, []).append(p)
+    return por_categoria
 
 def obtener_categorias_con_productos():
     """
     Devuelve las categorías únicas de la colección 'productos'
     que tienen al menos un documento con campo 'categoria'.
     """
-    productos_ref = db.collection("productos").stream()
-    categorias = {}
-
-    for doc in productos_ref:
-        data = doc.to_dict()
-        categoria = data.get("categoria", "").strip()
-        if categoria:
-            categorias[categoria] = categorias.get(categoria, 0) + 1
-
-    return list(categorias.items())  # [(categoria, total), ...]
+    categorias = catalogo_compartido().derivado("categorias_firestore", _categorias)
+    return [(categoria, len(productos)) for categoria, productos in categorias.items()]  # [(categoria, total), ...]
 
 def obtener_productos_por_categoria(nombre_categoria):
     """
@@ -23,6 +26,5 @@ def obtener_productos_por_categoria(nombre_categoria):
     """
     if not nombre_categoria:
         return []
-    productos_ref = db.collection("productos").where("categoria", "==", nombre_categoria).stream()
-    productos = [doc.to_dict() for doc in productos_ref]
-    return productos
+    productos = catalogo_compartido().derivado("categorias_firestore", _categorias).get(nombre_categoria, [])
+    return [p.a_dict() for p in productos]
@@ -0,0 +1,78 @@
+# deduplicacion.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Configuración (variables de entorno)
+# Segundos durante los que se recuerda un mid ya recibido (Facebook reintenta durante un buen rato)
+DEDUP_VENTANA = int(os.environ.get("DEDUP_VENTANA", 3600))
+DEDUP_MAX_IDS = int(os.environ.get("DEDUP_MAX_IDS", 50000))
+
+
+class DeduplicadorEventos:
+    """
+    Descarta los eventos de Messenger que Facebook vuelve a entregar (mismo
+    mid) cuando tardamos en responder. Los mids vistos se recuerdan durante
+    una ventana de tiempo en un OrderedDict acotado: como todos viven lo
+    mismo, los más viejos están siempre al principio y se purgan en O(1).
+
+    Con un backend de estado compartido (Redis) además se reserva el mid
+    ahí, para que un reintento que cae en otro worker también se descarte.
+    """
+
+    def __init__(self, ventana=DEDUP_VENTANA, max_ids=DEDUP_MAX_IDS, estado=None):
+        self.ventana = ventana
+        self.max_ids = max_ids
+        self.estado = estado if estado is not None and estado.compartido else None
+        self._lock = threading.Lock()
+        self._vistos = OrderedDict()  # mid -> expira_en
+        self._contadores = {"nuevos": 0, "duplicados": 0, "sin_mid": 0}
+
+    def _contar(self, clave):
+        with self._lock:
+            self._contadores[clave] += 1
+
+    def es_nuevo(self, mid):
+        """True la primera vez que llega un mid dentro de la ventana; False si es un reintento."""
+        if not mid:
+            self._contar("sin_mid")
+            return True
+        ahora = time.monotonic()
+        with self._lock:
+            while self._vistos:
+                primero, expira_en = next(iter(self._vistos.items()))
+                if expira_en > ahora and len(self._vistos) < self.max_ids:
+                    break
+                del self._vistos[primero]
+            expira_en = self._vistos.get(mid)
+            if expira_en is not None and expira_en > ahora:
+                self._contadores["duplicados"] += 1
+                return False
+            self._vistos[mid] = ahora + self.ventana
+        if self.estado is not None:
+            try:
+                if not self.estado.reservar("eventos", mid, self.ventana):
+                    self._contar("duplicados")
+                    return False
+            except Exception as e:
+                # Si el backend falla, al menos se deduplica dentro de este worker
+                print(f"⚠️ Error deduplicando en el estado compartido: {type(e).__name__} - {e}")
+        self._contar("nuevos")
+        return True
+
+    def olvidar(self, mid):
+        """Para eventos que no se llegaron a procesar: el reintento de Facebook debe entrar."""
+        if not mid:
+            return
+        with self._lock:
+            self._vistos.pop(mid, None)
+        if self.estado is not None:
+            try:
+                self.estado.borrar("eventos", mid)
+            except Exception:
+                pass
+
+    def metricas(self):
+        with self._lock:
+            return {**self._contadores, "recordados": len(self._vistos)}
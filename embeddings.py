@@ -0,0 +1,193 @@
+# embeddings.py
+import os
+import json
+import hashlib
+import threading
+
+# Configuración (variables de entorno)
+IA_EMBEDDINGS = os.environ.get("IA_EMBEDDINGS", "0") == "1"
+EMBEDDINGS_MODELO = os.environ.get("EMBEDDINGS_MODELO", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDINGS_DIR = os.environ.get("EMBEDDINGS_DIR", ".embeddings")
+EMBEDDINGS_LOTE = int(os.environ.get("EMBEDDINGS_LOTE", 64))
+
+
+def texto_producto(p):
+    return f"{p.nombre}. {p.categoria}. {p.descripcion}"
+
+
+def _huella(texto):
+    return hashlib.blake2b(texto.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class IndiceSemantico:
+    """
+    Recuperación semántica opcional con embeddings de oraciones calculados en
+    CPU (sentence-transformers). Los vectores normalizados viven en una
+    matriz NumPy que se guarda en disco y se abre con memory-map al arrancar;
+    solo se recalculan los productos nuevos o cuyo texto cambió. La búsqueda
+    es un producto matriz-vector (similitud coseno) y un top-k con argpartition.
+
+    Las actualizaciones corren en un hilo propio: mientras tanto las consultas
+    usan la matriz anterior. El modelo se carga en segundo plano (arranque o
+    primera actualización); hasta entonces buscar devuelve None y la
+    recuperación se queda con BM25.
+    """
+
+    def __init__(self, directorio=EMBEDDINGS_DIR, modelo=EMBEDDINGS_MODELO):
+        import numpy as np  # Dependencias opcionales
+        from sentence_transformers import SentenceTransformer
+        self.np = np
+        self.directorio = directorio
+        self.nombre_modelo = modelo
+        self._SentenceTransformer = SentenceTransformer
+        self._modelo = None
+        self._lock_modelo = threading.Lock()
+        self._lock = threading.Lock()
+        self._matriz = None
+        self._ids = []
+        self._huellas = {}
+        self._pendientes = set()
+        self._productos = {}
+        self._sincronizado = False
+        self._hay_trabajo = threading.Event()
+        self._hilo = None
+        self._cargar_disco()
+
+    def cargar_modelo(self):
+        """Carga el modelo una sola vez (puede tardar segundos o descargarlo); no llamar desde una petición."""
+        if self._modelo is None:
+            with self._lock_modelo:
+                if self._modelo is None:
+                    self._modelo = self._SentenceTransformer(self.nombre_modelo, device="cpu")
+                    print(f"✅ Modelo de embeddings cargado: {self.nombre_modelo}")
+        return self._modelo
+
+    # --- Persistencia ---
+    def _rutas(self):
+        return (os.path.join(self.directorio, "matriz.npy"), os.path.join(self.directorio, "ids.json"))
+
+    def _cargar_disco(self):
+        ruta_matriz, ruta_ids = self._rutas()
+        if not (os.path.exists(ruta_matriz) and os.path.exists(ruta_ids)):
+            return
+        try:
+            with open(ruta_ids, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("modelo") != self.nombre_modelo:
+                return
+            matriz = self.np.load(ruta_matriz, mmap_mode="r")
+            ids, huellas = meta["ids"], meta["huellas"]
+            if matriz.ndim != 2 or matriz.shape[0] != len(ids) or len(huellas) != len(ids):
+                # Los dos archivos se reemplazan por separado: una caída entre ambos los deja desparejos
+                print(f"⚠️ Embeddings en disco desparejos ({matriz.shape[0]} filas, {len(ids)} IDs); se recalculan")
+                del matriz
+                for ruta in (ruta_matriz, ruta_ids):
+                    os.remove(ruta)
+                return
+            self._matriz, self._ids = matriz, ids
+            self._huellas = dict(zip(ids, huellas))
+            print(f"✅ Embeddings cargados de disco: {len(self._ids)} productos")
+        except Exception as e:
+            print(f"🔥 Error cargando embeddings: {type(e).__name__} - {e}")
+
+    def _guardar_disco(self, matriz, ids, huellas):
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta_matriz, ruta_ids = self._rutas()
+        # Escritura atómica: archivo temporal y luego os.replace
+        with open(ruta_matriz + ".tmp", "wb") as f:
+            self.np.save(f, matriz)
+        with open(ruta_ids + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"modelo": self.nombre_modelo, "ids": ids, "huellas": [huellas[i] for i in ids]}, f)
+        os.replace(ruta_matriz + ".tmp", ruta_matriz)
+        os.replace(ruta_ids + ".tmp", ruta_ids)
+
+    # --- Actualización incremental ---
+    def actualizar(self, productos, cambiados):
+        """Suscriptor del catálogo: encola los productos cambiados para recalcular."""
+        with self._lock:
+            self._productos = productos
+            self._pendientes |= set(cambiados)
+            if not self._sincronizado:
+                # Primera carga: también se revisan los productos guardados en disco que ya no existen
+                self._pendientes |= set(self._huellas)
+                self._sincronizado = True
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="embeddings", daemon=True)
+                self._hilo.start()
+        self._hay_trabajo.set()
+
+    def _bucle(self):
+        while True:
+            self._hay_trabajo.wait()
+            self._hay_trabajo.clear()
+            with self._lock:
+                pendientes, self._pendientes = self._pendientes, set()
+                productos = self._productos
+            try:
+                self._aplicar(productos, pendientes)
+            except Exception as e:
+                print(f"🔥 Error actualizando embeddings: {type(e).__name__} - {e}")
+
+    def _aplicar(self, productos, pendientes):
+        np = self.np
+        textos, a_calcular = {}, []
+        for pid in pendientes:
+            if pid in productos:
+                textos[pid] = texto_producto(productos[pid])
+                if self._huellas.get(pid) != _huella(textos[pid]):
+                    a_calcular.append(pid)
+        eliminados = {pid for pid in pendientes if pid not in productos and pid in self._huellas}
+        if not a_calcular and not eliminados:
+            return
+
+        vectores = {}
+        if a_calcular:
+            emb = self.cargar_modelo().encode([textos[pid] for pid in a_calcular], batch_size=EMBEDDINGS_LOTE,
+                                              normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+            vectores = dict(zip(a_calcular, emb))
+
+        # Copia en memoria de la matriz (la de disco está mapeada en solo lectura)
+        ids = [pid for pid in self._ids if pid not in eliminados]
+        filas = {pid: i for i, pid in enumerate(self._ids)}
+        dim = len(next(iter(vectores.values()))) if vectores else self._matriz.shape[1]
+        nuevos = [pid for pid in a_calcular if pid not in filas]
+        matriz = np.empty((len(ids) + len(nuevos), dim), dtype=np.float32)
+        if ids:
+            matriz[:len(ids)] = self._matriz[[filas[pid] for pid in ids]]
+        ids += nuevos
+        for i, pid in enumerate(ids):
+            if pid in vectores:
+                matriz[i] = vectores[pid]
+
+        huellas = {pid: self._huellas.get(pid) for pid in ids}
+        huellas.update({pid: _huella(textos[pid]) for pid in a_calcular})
+        with self._lock:
+            self._matriz, self._ids, self._huellas = matriz, ids, huellas
+        self._guardar_disco(matriz, ids, huellas)
+        print(f"🔄 Embeddings actualizados: {len(a_calcular)} calculados, {len(eliminados)} eliminados")
+
+    # --- Consulta ---
+    def buscar(self, consulta, k=10):
+        """IDs de los k productos más parecidos a la consulta (similitud coseno); None si el modelo aún no carga."""
+        modelo = self._modelo
+        if modelo is None:
+            return None
+        with self._lock:
+            matriz, ids = self._matriz, self._ids
+        if matriz is None or not ids or not consulta:
+            return []
+        q = modelo.encode([consulta], normalize_embeddings=True, convert_to_numpy=True)[0].astype(self.np.float32)
+        puntajes = matriz @ q
+        k = min(k, len(ids))
+        mejores = self.np.argpartition(-puntajes, k - 1)[:k]
+        return [ids[i] for i in mejores[self.np.argsort(-puntajes[mejores])]]
+
+
+def crear_indice_semantico():
+    if not IA_EMBEDDINGS:
+        return None
+    try:
+        return IndiceSemantico()
+    except ImportError as e:
+        print(f"⚠️ IA_EMBEDDINGS=1 pero faltan dependencias ({e}); se usa solo BM25")
+        return None
@@ -0,0 +1,175 @@
+# envio_facebook.py
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+GRAPH_SEND_URL = "https://graph.facebook.com/v18.0/me/messages"
+
+# Configuración (variables de entorno)
+ENVIO_HILOS = int(os.environ.get("ENVIO_HILOS", 8))
+ENVIO_TIMEOUT_CONEXION = float(os.environ.get("ENVIO_TIMEOUT_CONEXION", 3.05))
+ENVIO_TIMEOUT_LECTURA = float(os.environ.get("ENVIO_TIMEOUT_LECTURA", 10))
+ENVIO_REINTENTOS = int(os.environ.get("ENVIO_REINTENTOS", 3))
+ENVIO_BACKOFF_BASE = float(os.environ.get("ENVIO_BACKOFF_BASE", 0.5))
+ENVIO_BACKOFF_MAX = float(os.environ.get("ENVIO_BACKOFF_MAX", 8))
+# Llamadas por segundo a la Send API para toda la página
+ENVIO_TASA = int(os.environ.get("ENVIO_TASA", 40))
+
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+
+class EnviadorFacebook:
+    """
+    Cliente de la Send API de Messenger con conexiones keep-alive reutilizadas.
+    Cada destinatario tiene su propia bandeja de salida: sus mensajes se envían
+    uno tras otro (para que aparezcan en orden en su pantalla) mientras que las
+    bandejas de distintos usuarios se vacían en paralelo.
+    """
+
+    def __init__(self, token, hilos=ENVIO_HILOS, reintentos=ENVIO_REINTENTOS,
+                 timeout=(ENVIO_TIMEOUT_CONEXION, ENVIO_TIMEOUT_LECTURA), limitador=None):
+        self.token = token
+        self.limitador = limitador
+        self.hilos = max(1, hilos)
+        self.reintentos = reintentos
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._pool = None
+        self._bandejas = {}
+        self._contadores = {"enviados": 0, "fallidos": 0, "reintentos": 0, "sin_limitador": 0}
+
+    def _iniciar(self):
+        # Sesión y pool de hilos por proceso (no sobreviven a un fork de gunicorn)
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.hilos)
+            session.mount("https://", adapter)
+            self._session = session
+            self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="graph-send")
+            self._bandejas = {}
+            self._pid = os.getpid()
+
+    # --- Envío con reintentos ---
+    def _espera_backoff(self, intento, resp=None):
+        if resp is not None and resp.headers.get("Retry-After", "").isdigit():
+            return min(ENVIO_BACKOFF_MAX, float(resp.headers["Retry-After"]))
+        # Backoff exponencial con jitter completo
+        return random.uniform(0, min(ENVIO_BACKOFF_MAX, ENVIO_BACKOFF_BASE * (2 ** intento)))
+
+    def _post(self, payload):
+        for intento in range(self.reintentos + 1):
+            resp = None
+            if self.limitador is not None:
+                try:
+                    self.limitador.esperar("pagina")
+                except Exception as e:
+                    # Backend del limitador caído (p. ej. Redis): se envía sin regular antes que silenciar al usuario
+                    print(f"⚠️ Limitador de envío no disponible: {type(e).__name__} - {e}")
+                    self._contar("sin_limitador")
+            try:
+                resp = self._session.post(GRAPH_SEND_URL, params={"access_token": self.token},
+                                          json=payload, timeout=self.timeout)
+                if resp.status_code < 400:
+                    self._contar("enviados")
+                    return True
+                if resp.status_code not in CODIGOS_REINTENTABLES:
+                    print(f"Error enviando mensaje: {resp.status_code} - {resp.text[:200]}")
+                    break
+            except requests.RequestException as e:
+                print(f"Error enviando mensaje: {type(e).__name__} - {e}")
+            if intento < self.reintentos:
+                self._contar("reintentos")
+                time.sleep(self._espera_backoff(intento, resp))
+        self._contar("fallidos")
+        return False
+
+    def _contar(self, clave):
+        with self._lock:
+            self._contadores[clave] += 1
+
+    # --- Bandejas de salida por destinatario ---
+    def enviar(self, id_usuario, message):
+        """Agrega un mensaje a la bandeja del usuario; no bloquea al llamador."""
+        self._encolar(id_usuario, {"recipient": {"id": id_usuario}, "message": message})
+
+    def enviar_accion(self, id_usuario, accion):
+        """sender_action de Messenger, p. ej. "typing_on" mientras se prepara la respuesta."""
+        self._encolar(id_usuario, {"recipient": {"id": id_usuario}, "sender_action": accion})
+
+    def _encolar(self, id_usuario, payload):
+        self._iniciar()
+        with self._lock:
+            bandeja = self._bandejas.get(id_usuario)
+            if bandeja is not None:
+                bandeja.append(payload)
+                return
+            self._bandejas[id_usuario] = deque([payload])
+        self._pool.submit(self._vaciar, id_usuario)
+
+    def _vaciar(self, id_usuario):
+        vacia = False
+        try:
+            while True:
+                with self._lock:
+                    bandeja = self._bandejas[id_usuario]
+                    if not bandeja:
+                        del self._bandejas[id_usuario]
+                        vacia = True
+                        return
+                    payload = bandeja.popleft()
+                try:
+                    self._post(payload)
+                except Exception as e:
+                    # Un error inesperado pierde este mensaje, no los siguientes del usuario
+                    print(f"🔥 Error inesperado enviando a {id_usuario}: {type(e).__name__} - {e}")
+                    self._contar("fallidos")
+        finally:
+            if not vacia:
+                # La tarea terminó con mensajes pendientes: se reprograma o se suelta la bandeja,
+                # si no, enviar() seguiría agregando a una bandeja que nadie vacía
+                self._reprogramar(id_usuario)
+
+    def _reprogramar(self, id_usuario):
+        try:
+            self._pool.submit(self._vaciar, id_usuario)
+        except RuntimeError:
+            # Pool ya cerrado (apagado del proceso)
+            with self._lock:
+                self._bandejas.pop(id_usuario, None)
+
+    def enviar_texto(self, id_usuario, texto):
+        self.enviar(id_usuario, {"text": texto})
+
+    def enviar_imagen(self, id_usuario, url_img):
+        self.enviar(id_usuario, {
+            "attachment": {
+                "type": "image",
+                "payload": {"url": url_img, "is_reusable": True}
+            }
+        })
+
+    def cerrar(self, esperar=True):
+        """Vacía las bandejas pendientes y libera las conexiones."""
+        if self._pid != os.getpid():
+            return
+        self._pool.shutdown(wait=esperar)
+        self._session.close()
+        self._pid = None
+
+    def metricas(self):
+        with self._lock:
+            return {
+                **self._contadores,
+                "bandejas_activas": len(self._bandejas),
+                "pendientes": sum(len(b) for b in self._bandejas.values()),
+            }
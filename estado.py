@@ -0,0 +1,210 @@
+# estado.py
+import os
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from rate_limit import LimitadorTasa, LimitadorTasaRedis
+
+# Configuración (variables de entorno)
+ESTADO_BACKEND = os.environ.get("ESTADO_BACKEND", "memoria")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+ESTADO_PREFIJO = os.environ.get("ESTADO_PREFIJO", "freres")
+# Máximo de entradas por espacio en memoria y cada cuántos segundos se purgan las vencidas
+ESTADO_MAX_CLAVES = int(os.environ.get("ESTADO_MAX_CLAVES", 10000))
+ESTADO_PURGA = int(os.environ.get("ESTADO_PURGA", 60))
+
+
+class EstadoMemoria:
+    """
+    Backend de estado en la RAM del proceso (valor por defecto).
+    Guarda los objetos tal cual, sin serializar, así que solo sirve
+    con un único worker de gunicorn.
+
+    La memoria está acotada: cada espacio conserva como máximo max_claves
+    entradas (se desaloja la usada hace más tiempo) y las que pasan su TTL
+    de inactividad se purgan periódicamente. al_desalojar(espacio, clave,
+    valor) se llama antes de soltar cada entrada, p. ej. para persistirla.
+    """
+
+    compartido = False
+
+    def __init__(self, max_claves=ESTADO_MAX_CLAVES, al_desalojar=None):
+        self.max_claves = max_claves
+        self.al_desalojar = al_desalojar
+        self._lock = threading.Lock()
+        self._datos = {}     # espacio -> OrderedDict(clave -> (valor, expira_en, bytes))
+        self._ultima_purga = time.monotonic()
+        self._desalojados = {}
+
+    def obtener(self, espacio, clave):
+        with self._lock:
+            entradas = self._datos.get(espacio)
+            entrada = entradas.get(clave) if entradas else None
+            if entrada is None:
+                return None
+            valor, expira_en, _ = entrada
+            if expira_en is not None and time.monotonic() >= expira_en:
+                del entradas[clave]
+                desalojados = [(espacio, clave, valor)]
+            else:
+                entradas.move_to_end(clave)
+                return valor
+        self._notificar(desalojados)
+        return None
+
+    def guardar(self, espacio, clave, valor, ttl=None):
+        expira_en = time.monotonic() + ttl if ttl else None
+        tam = len(json.dumps(valor, default=str))
+        desalojados = []
+        with self._lock:
+            entradas = self._datos.setdefault(espacio, OrderedDict())
+            entradas[clave] = (valor, expira_en, tam)
+            entradas.move_to_end(clave)
+            while len(entradas) > self.max_claves:
+                k, (v, _, _) = entradas.popitem(last=False)
+                desalojados.append((espacio, k, v))
+            desalojados += self._purgar_vencidos()
+        self._notificar(desalojados)
+
+    def borrar(self, espacio, clave):
+        with self._lock:
+            self._datos.get(espacio, {}).pop(clave, None)
+
+    def reservar(self, espacio, clave, ttl):
+        """Guarda la clave solo si no existe (o venció); devuelve True si la reservó."""
+        with self._lock:
+            entrada = self._datos.get(espacio, {}).get(clave)
+            if entrada is not None and (entrada[1] is None or time.monotonic() < entrada[1]):
+                return False
+        self.guardar(espacio, clave, True, ttl=ttl)
+        return True
+
+    def adquirir(self, espacio, clave, ttl):
+        """Lease exclusivo sobre la clave por ttl segundos: devuelve un token, o None si otro lo tiene."""
+        token = uuid.uuid4().hex
+        with self._lock:
+            entrada = self._datos.get(espacio, {}).get(clave)
+            if entrada is not None and (entrada[1] is None or time.monotonic() < entrada[1]):
+                return None
+            self._datos.setdefault(espacio, OrderedDict())[clave] = (token, time.monotonic() + ttl, len(token))
+        return token
+
+    def liberar(self, espacio, clave, token):
+        """Suelta el lease solo si sigue siendo nuestro (no uno tomado por otro tras vencer)."""
+        with self._lock:
+            entradas = self._datos.get(espacio, {})
+            if clave in entradas and entradas[clave][0] == token:
+                del entradas[clave]
+
+    def limitador(self, espacio, capacidad, ventana, capacidad_global=None, ventana_global=None):
+        return LimitadorTasa(capacidad, ventana, capacidad_global, ventana_global, max_claves=self.max_claves)
+
+    # --- Límites de memoria ---
+    def _purgar_vencidos(self):
+        # Se llama con el lock tomado; como mucho una vez cada ESTADO_PURGA segundos
+        ahora = time.monotonic()
+        if ahora - self._ultima_purga < ESTADO_PURGA:
+            return []
+        self._ultima_purga = ahora
+        desalojados = []
+        for espacio, entradas in self._datos.items():
+            for k in [k for k, (_, expira_en, _) in entradas.items() if expira_en is not None and ahora >= expira_en]:
+                desalojados.append((espacio, k, entradas.pop(k)[0]))
+        return desalojados
+
+    def _notificar(self, desalojados):
+        for espacio, clave, valor in desalojados:
+            with self._lock:
+                self._desalojados[espacio] = self._desalojados.get(espacio, 0) + 1
+            if self.al_desalojar:
+                try:
+                    self.al_desalojar(espacio, clave, valor)
+                except Exception as e:
+                    print(f"🔥 Error al desalojar {espacio}/{clave}: {type(e).__name__} - {e}")
+
+    def metricas(self):
+        with self._lock:
+            return {
+                espacio: {
+                    "entradas": len(entradas),
+                    "bytes_aprox": sum(tam for _, _, tam in entradas.values()),
+                    "desalojados": self._desalojados.get(espacio, 0),
+                }
+                for espacio, entradas in self._datos.items()
+            }
+
+
+_SCRIPT_LIBERAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class EstadoRedis:
+    """
+    Backend compartido entre workers y servidores sobre Redis (o cualquier
+    servidor compatible). Recibe opcionalmente un cliente ya creado, por
+    ejemplo fakeredis.FakeRedis() para pruebas locales.
+    """
+
+    compartido = True
+
+    def __init__(self, cliente=None, url=REDIS_URL, prefijo=ESTADO_PREFIJO):
+        if cliente is None:
+            import redis  # Dependencia opcional
+            cliente = redis.Redis.from_url(url)
+        self.cliente = cliente
+        self.prefijo = prefijo
+        self._liberar = cliente.register_script(_SCRIPT_LIBERAR)
+
+    def _clave(self, espacio, clave):
+        return f"{self.prefijo}:{espacio}:{clave}"
+
+    def obtener(self, espacio, clave):
+        crudo = self.cliente.get(self._clave(espacio, clave))
+        return json.loads(crudo) if crudo is not None else None
+
+    def guardar(self, espacio, clave, valor, ttl=None):
+        self.cliente.set(self._clave(espacio, clave), json.dumps(valor, default=str), ex=ttl)
+
+    def borrar(self, espacio, clave):
+        self.cliente.delete(self._clave(espacio, clave))
+
+    def reservar(self, espacio, clave, ttl):
+        # SET NX: atómico entre todos los workers
+        return bool(self.cliente.set(self._clave(espacio, clave), "1", ex=ttl, nx=True))
+
+    def adquirir(self, espacio, clave, ttl):
+        token = uuid.uuid4().hex
+        if self.cliente.set(self._clave(espacio, clave), token, px=int(ttl * 1000), nx=True):
+            return token
+        return None
+
+    def liberar(self, espacio, clave, token):
+        # Comparar y borrar en un solo paso (Lua), para no soltar el lease de otro worker
+        self._liberar(keys=[self._clave(espacio, clave)], args=[token])
+
+    def metricas(self):
+        # Redis desaloja por TTL (SET ... EX); el tamaño se consulta con INFO memory
+        return {"backend": "redis"}
+
+    def limitador(self, espacio, capacidad, ventana, capacidad_global=None, ventana_global=None):
+        return LimitadorTasaRedis(self.cliente, f"{self.prefijo}:{espacio}", capacidad, ventana,
+                                  capacidad_global, ventana_global)
+
+
+def crear_backend(nombre=ESTADO_BACKEND, al_desalojar=None):
+    if nombre == "redis":
+        try:
+            backend = EstadoRedis()
+            backend.cliente.ping()
+            print("✅ Estado compartido en Redis")
+            return backend
+        except Exception as e:
+            print(f"🔥 No se pudo usar Redis ({type(e).__name__} - {e}), usando memoria local")
+    return EstadoMemoria(al_desalojar=al_desalojar)
@@ -1,6 +1,7 @@
 # archivo: flujo_pedido.py
 import datetime
-from conexion_firebase import db, obtener_productos
+from catalogo import catalogo_compartido
+from historial_pedidos import crear_pedido as guardar_pedido
 
 # =============================
 # FUNCIONES DE PEDIDOS
@@ -10,7 +11,7 @@ def crear_pedido(telefono_usuario, productos_solicitados, metodo_entrega="envio_
     Registra un pedido en la colección 'pedidos'.
     productos_solicitados debe ser una lista de IDs como ['P001', 'P002']
     """
-    productos_disponibles = obtener_productos()
+    productos_disponibles = catalogo_compartido().productos()
     items = []
     monto_total = 0
 
@@ -19,19 +20,19 @@ def crear_pedido(telefono_usuario, productos_solicitados, metodo_entrega="envio_
         if not producto:
             continue  # producto no encontrado
 
-        stock_disponible = int(producto.get("stock", {}).get("Piezas", 0))
+        stock_disponible = producto.stock
         if stock_disponible <= 0:
             continue  # sin stock
 
         # Agregamos al pedido
         items.append({
             "producto_id": pid,
-            "nombre": producto.get("nombre"),
-            "precio": producto.get("precio"),
-            "imagen": producto.get("imagen_url"),
+            "nombre": producto.nombre,
+            "precio": producto.precio,
+            "imagen": producto.imagen_url,
             "cantidad": stock_disponible
         })
-        monto_total += producto.get("precio", 0)
+        monto_total += producto.precio
 
     if not items:
         return "⚠️ No se pudo crear el pedido. Los productos están agotados o no existen."
@@ -43,14 +44,15 @@ def crear_pedido(telefono_usuario, productos_solicitados, metodo_entrega="envio_
         "comprobante_url": "pendiente",
         "preferencia_entrega": metodo_entrega,
         "monto_total": monto_total,
-        "creado_en": datetime.datetime.utcnow().isoformat() + "Z",
+        # Mismo campo que los pedidos del bot, para que aparezcan en el historial
+        "fecha": datetime.datetime.now(),
         "items": items,
         "expira_en": ""
     }
 
     try:
-        pedido_ref = db.collection("pedidos").document()
-        pedido_ref.set(nuevo_pedido)
+        # El pedido y el resumen del usuario se escriben juntos
+        guardar_pedido(nuevo_pedido)
         return f"✅ Tu pedido fue registrado correctamente. Total a pagar: ${monto_total}. Pronto te contactaremos."
     except Exception as e:
         print("Error al guardar el pedido:", e)
@@ -60,17 +62,17 @@ def crear_pedido(telefono_usuario, productos_solicitados, metodo_entrega="envio_
 # FUNCIONES OPCIONALES
 # =============================
 def formatear_productos_para_usuario():
-    productos = obtener_productos()
+    productos = catalogo_compartido().productos()
     mensajes = []
 
     if not productos:
         return [{"text": {"text": ["No hay productos disponibles en este momento."]}}]
 
     for pid, p in productos.items():
-        nombre = p.get("nombre", "Producto")
-        precio = p.get("precio", "N/A")
-        stock = p.get("stock", {}).get("Piezas", "0")
-        imagen = p.get("imagen_url", "")
+        nombre = p.nombre or "Producto"
+        precio = p.precio_texto
+        stock = p.stock
+        imagen = p.imagen_url
 
         # 🧾 Mensaje de texto
         texto = f"🧸 {nombre}\n💵 ${precio} MXN\n📦 Stock: {stock} unidades"
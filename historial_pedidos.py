@@ -0,0 +1,184 @@
+# historial_pedidos.py
+import os
+from datetime import datetime, timezone
+
+from conexion_firebase import db
+
+# Configuración (variables de entorno)
+HISTORIAL_COLECCION = os.environ.get("HISTORIAL_COLECCION", "pedidos_usuario")
+# Pedidos que guarda el resumen de cada usuario (los más recientes primero)
+HISTORIAL_RECIENTES = int(os.environ.get("HISTORIAL_RECIENTES", 10))
+
+
+# --- Resumen por usuario: pedidos_usuario/{telefono} ---
+# {"recientes": [{"id", "fecha", "estado", "total", "productos"}, ...], "total_pedidos": n}
+# Se escribe en la misma transacción que crea el pedido, así "mi pedido" es
+# una sola lectura de documento y no necesita índice compuesto.
+
+def ref_resumen(telefono):
+    return db.collection(HISTORIAL_COLECCION).document(str(telefono))
+
+
+def fecha_pedido(pedido):
+    """Fecha del pedido; los pedidos antiguos de flujo_pedido la guardaban como texto ISO en creado_en."""
+    fecha = pedido.get("fecha")
+    if fecha is None and pedido.get("creado_en"):
+        try:
+            fecha = datetime.fromisoformat(pedido["creado_en"].replace("Z", "+00:00"))
+        except (TypeError, ValueError):
+            fecha = None
+    return fecha
+
+
+def _entrada(pedido_id, pedido):
+    return {
+        "id": pedido_id,
+        "fecha": fecha_pedido(pedido),
+        "estado": pedido.get("estado"),
+        "total": pedido.get("total", pedido.get("monto_total")),
+        "productos": len(pedido.get("productos") or pedido.get("items") or []),
+    }
+
+
+def escribir_resumen(transaction, snapshot_resumen, pedido_id, pedido):
+    """
+    Agrega el pedido al resumen del usuario dentro de una transacción.
+    snapshot_resumen es la lectura del resumen hecha en la misma transacción
+    (Firestore exige leer antes de escribir).
+    """
+    datos = snapshot_resumen.to_dict() if snapshot_resumen is not None and snapshot_resumen.exists else {}
+    recientes = [_entrada(pedido_id, pedido)] + [e for e in datos.get("recientes", []) if e.get("id") != pedido_id]
+    transaction.set(ref_resumen(pedido["telefono"]), {
+        "recientes": recientes[:HISTORIAL_RECIENTES],
+        "total_pedidos": datos.get("total_pedidos", 0) + 1,
+    })
+
+
+def crear_pedido(pedido, coleccion_pedidos="pedidos"):
+    """Crea el pedido y actualiza el resumen del usuario en una sola transacción. Devuelve el ID."""
+    pedido_ref = db.collection(coleccion_pedidos).document()
+    from firebase_admin import firestore  # Ya cargado por obtener_db al crear la referencia
+
+    @firestore.transactional
+    def _ejecutar(transaction):
+        resumen = ref_resumen(pedido["telefono"]).get(transaction=transaction)
+        transaction.set(pedido_ref, pedido)
+        escribir_resumen(transaction, resumen, pedido_ref.id, pedido)
+
+    _ejecutar(db.transaction())
+    return pedido_ref.id
+
+
+def actualizar_estado(pedido_id, estado, coleccion_pedidos="pedidos"):
+    """Cambia el estado de un pedido y de su entrada en el resumen del usuario."""
+    pedido_ref = db.collection(coleccion_pedidos).document(pedido_id)
+    from firebase_admin import firestore
+
+    @firestore.transactional
+    def _ejecutar(transaction):
+        pedido = pedido_ref.get(transaction=transaction)
+        if not pedido.exists:
+            return False
+        telefono = pedido.to_dict().get("telefono")
+        resumen = ref_resumen(telefono).get(transaction=transaction) if telefono else None
+        transaction.update(pedido_ref, {"estado": estado})
+        if resumen is not None and resumen.exists:
+            recientes = resumen.to_dict().get("recientes", [])
+            for e in recientes:
+                if e.get("id") == pedido_id:
+                    e["estado"] = estado
+            transaction.update(resumen.reference, {"recientes": recientes})
+        return True
+
+    return _ejecutar(db.transaction())
+
+
+# --- Consultas ---
+def ultimo_pedido(telefono):
+    """El pedido más reciente del usuario (una lectura de documento) o None."""
+    pagina, _ = historial(telefono, limite=1)
+    return pagina[0] if pagina else None
+
+
+def historial(telefono, limite=5, cursor=None, coleccion_pedidos="pedidos"):
+    """
+    Página del historial de pedidos, del más reciente al más antiguo.
+    Devuelve (pedidos, cursor_siguiente); cursor_siguiente es None si no hay más.
+
+    La primera página sale del resumen. Las siguientes (más allá de los
+    HISTORIAL_RECIENTES del resumen) consultan 'pedidos' por telefono y fecha,
+    lo que requiere el índice compuesto telefono ASC + fecha DESC.
+    """
+    try:
+        from firebase_admin import firestore
+        if cursor is None:
+            doc = ref_resumen(telefono).get()
+            if doc.exists:
+                datos = doc.to_dict()
+                recientes, total = datos.get("recientes", []), datos.get("total_pedidos", 0)
+                if limite <= len(recientes) or total <= len(recientes):
+                    pagina = recientes[:limite]
+                    return pagina, (pagina[-1]["id"] if total > len(pagina) and pagina else None)
+            # Sin resumen (usuario aún no migrado con el backfill) o página más grande que el resumen
+        consulta = db.collection(coleccion_pedidos).where("telefono", "==", telefono)\
+                     .order_by("fecha", direction=firestore.Query.DESCENDING)
+        if cursor is not None:
+            anterior = db.collection(coleccion_pedidos).document(cursor).get()
+            if not anterior.exists:
+                return [], None
+            consulta = consulta.start_after(anterior)
+        docs = list(consulta.limit(limite + 1).stream())
+        pagina = [_entrada(d.id, d.to_dict()) for d in docs[:limite]]
+        return pagina, (pagina[-1]["id"] if len(docs) > limite else None)
+    except Exception as e:
+        print(f"🔥 Error leyendo historial de {telefono}: {type(e).__name__} - {e}")
+        return [], None
+
+
+def _fecha_comparable(fecha, minimo):
+    # Mezcla de fechas con y sin zona horaria: las ingenuas se toman como UTC
+    if not isinstance(fecha, datetime):
+        return minimo
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+
+# ==========================================
+# BACKFILL: resúmenes para los pedidos que ya existen
+# ==========================================
+# Uso: python historial_pedidos.py
+# Recorre 'pedidos' una vez, agrega "fecha" a los pedidos que solo tienen
+# "creado_en" y reescribe el resumen de cada usuario. Se puede repetir.
+if __name__ == "__main__":
+    LOTE = 400
+    por_usuario = {}
+    batch, en_lote, corregidos = db.batch(), 0, 0
+    for doc in db.collection("pedidos").stream():
+        pedido = doc.to_dict()
+        if not pedido.get("telefono"):
+            continue
+        if "fecha" not in pedido:
+            fecha = fecha_pedido(pedido)
+            if fecha is not None:
+                pedido["fecha"] = fecha
+                batch.update(doc.reference, {"fecha": fecha})
+                en_lote += 1
+                corregidos += 1
+        por_usuario.setdefault(pedido["telefono"], []).append((doc.id, pedido))
+        if en_lote >= LOTE:
+            batch.commit()
+            batch, en_lote = db.batch(), 0
+
+    minimo = datetime.min.replace(tzinfo=timezone.utc)
+    for telefono, pedidos in por_usuario.items():
+        pedidos.sort(key=lambda x: _fecha_comparable(x[1].get("fecha"), minimo), reverse=True)
+        batch.set(ref_resumen(telefono), {
+            "recientes": [_entrada(pid, p) for pid, p in pedidos[:HISTORIAL_RECIENTES]],
+            "total_pedidos": len(pedidos),
+        })
+        en_lote += 1
+        if en_lote >= LOTE:
+            batch.commit()
+            batch, en_lote = db.batch(), 0
+    if en_lote:
+        batch.commit()
+    print(f"✅ Backfill terminado: {len(por_usuario)} usuarios, {corregidos} pedidos con fecha corregida")
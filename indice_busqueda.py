@@ -0,0 +1,143 @@
+# indice_busqueda.py
+import heapq
+from bisect import bisect_left
+
+# Peso de cada campo al ordenar resultados
+PESOS_CAMPOS = {"nombre": 3.0, "categoria": 2.0, "descripcion": 1.0}
+# Las palabras más cortas solo coinciden de forma exacta (evita recorrer medio índice con "a")
+MIN_PREFIJO = 2
+# Longitud mínima para buscar también dentro de las palabras ("misa" -> "camisa")
+MIN_INFIJO = 3
+# Puntos por tipo de coincidencia de un token (se multiplican por el peso del campo)
+PUNTOS_EXACTO, PUNTOS_PREFIJO, PUNTOS_INFIJO = 2.0, 1.0, 0.5
+
+
+class IndiceProductos:
+    """
+    Índice invertido del catálogo: token normalizado -> IDs de producto, por campo.
+    Se construye una sola vez por cada recarga del catálogo. Las palabras
+    parciales ("cami" -> "camisa") se resuelven con búsqueda binaria sobre la
+    lista ordenada de tokens de cada campo, y las que aparecen dentro de otra
+    ("misa" -> "camisa") con un índice de trigramas sobre el vocabulario.
+    """
+
+    def __init__(self, productos, normalizar, campos=tuple(PESOS_CAMPOS)):
+        self.productos = productos
+        self.normalizar = normalizar
+        self.campos = campos
+        self._orden = {}
+        self._postings = {c: {} for c in campos}
+        for i, (pid, p) in enumerate(productos.items()):
+            self._orden[pid] = i
+            for campo in campos:
+                for token in set(p.normalizado(campo).split()):
+                    self._postings[campo].setdefault(token, []).append(pid)
+        self._tokens = {c: sorted(self._postings[c]) for c in campos}
+        # Trigramas del vocabulario (no de los productos): trigrama -> tokens que lo contienen
+        self._trigramas = {c: {} for c in campos}
+        for campo in campos:
+            trigramas = self._trigramas[campo]
+            for token in self._tokens[campo]:
+                for i in range(len(token) - 2):
+                    trigramas.setdefault(token[i:i + 3], set()).add(token)
+
+    def __len__(self):
+        return len(self._orden)
+
+    def _grupos(self, campo, token):
+        """Tokens del vocabulario que coinciden, agrupados: [(puntos, [tokens]), ...] de mayor a menor."""
+        grupos = []
+        if token in self._postings[campo]:
+            grupos.append((PUNTOS_EXACTO, [token]))
+        if len(token) < MIN_PREFIJO:
+            return grupos
+        tokens = self._tokens[campo]
+        i = bisect_left(tokens, token)
+        prefijos = []
+        while i < len(tokens) and tokens[i].startswith(token):
+            if tokens[i] != token:
+                prefijos.append(tokens[i])
+            i += 1
+        if prefijos:
+            grupos.append((PUNTOS_PREFIJO, prefijos))
+        if len(token) >= MIN_INFIJO:
+            trigramas = self._trigramas[campo]
+            candidatos = None
+            for j in range(len(token) - 2):
+                con_trigrama = trigramas.get(token[j:j + 3])
+                if not con_trigrama:
+                    candidatos = None
+                    break
+                candidatos = con_trigrama if candidatos is None else candidatos & con_trigrama
+            infijos = [t for t in candidatos or () if token in t and not t.startswith(token)]
+            if infijos:
+                grupos.append((PUNTOS_INFIJO, sorted(infijos)))
+        return grupos
+
+    def _coincidencias(self, campo, token):
+        """Devuelve {pid: puntos} para un token: exacto vale 2, prefijo 1 y dentro de otra palabra 0.5."""
+        postings = self._postings[campo]
+        puntos = {}
+        for p, tokens in self._grupos(campo, token):
+            for t in tokens:
+                for pid in postings[t]:
+                    puntos.setdefault(pid, p)
+        return puntos
+
+    def _mejores_un_token(self, token, campos, limite):
+        # Los puntajes posibles de un solo token son pocos: se recorren de mayor a menor y,
+        # dentro de cada uno, las listas de IDs (ya en orden de catálogo) se mezclan sin
+        # materializar el resto. Se detiene al juntar 'limite' resultados.
+        por_puntaje = {}
+        for campo in campos:
+            peso = PESOS_CAMPOS.get(campo, 1.0)
+            postings = self._postings[campo]
+            for p, tokens in self._grupos(campo, token):
+                por_puntaje.setdefault(p * peso, []).extend(postings[t] for t in tokens)
+        vistos, resultado = set(), []
+        for puntaje in sorted(por_puntaje, reverse=True):
+            for pid in heapq.merge(*por_puntaje[puntaje], key=self._orden.__getitem__):
+                if pid in vistos:
+                    continue
+                vistos.add(pid)
+                resultado.append(pid)
+                if len(resultado) == limite:
+                    return resultado
+        return resultado
+
+    def buscar(self, consulta, campos=None, todas=True, limite=None, min_longitud=1):
+        """
+        Devuelve los IDs que coinciden con la consulta, ordenados por relevancia.
+        todas=True exige que cada palabra aparezca en algún campo (búsqueda);
+        todas=False basta con una (recuperación de contexto para la IA).
+        Con limite, pedir uno de más dice si hay más resultados sin calcularlos todos.
+        """
+        campos = campos or self.campos
+        tokens = [t for t in dict.fromkeys(self.normalizar(consulta).split()) if len(t) >= min_longitud]
+        if not tokens:
+            return []
+        if len(tokens) == 1 and limite is not None:
+            return self._mejores_un_token(tokens[0], campos, limite)
+
+        puntajes = None
+        for token in tokens:
+            por_token = {}
+            for campo in campos:
+                peso = PESOS_CAMPOS.get(campo, 1.0)
+                for pid, p in self._coincidencias(campo, token).items():
+                    if p * peso > por_token.get(pid, 0):
+                        por_token[pid] = p * peso
+            if puntajes is None:
+                puntajes = por_token
+            elif todas:
+                puntajes = {pid: s + por_token[pid] for pid, s in puntajes.items() if pid in por_token}
+            else:
+                for pid, s in por_token.items():
+                    puntajes[pid] = puntajes.get(pid, 0) + s
+            if todas and not puntajes:
+                return []
+
+        clave = lambda pid: (-puntajes[pid], self._orden[pid])
+        if limite is not None:
+            return heapq.nsmallest(limite, puntajes, key=clave)
+        return sorted(puntajes, key=clave)
@@ -0,0 +1,86 @@
+# normalizacion.py
+import os
+import string
+import unicodedata
+from functools import lru_cache
+
+# Configuración (variables de entorno)
+NORMALIZAR_MEMO = int(os.environ.get("NORMALIZAR_MEMO", 20000))
+
+
+def _normalizar_unicode(t):
+    # Camino general (el de siempre): descomposición NFD y se quitan los acentos
+    t = unicodedata.normalize("NFD", t)
+    t = "".join(c for c in t if not unicodedata.combining(c))
+    return t.translate(_SIN_PUNTUACION)
+
+
+_SIN_PUNTUACION = str.maketrans("", "", string.punctuation)
+# Tabla precompilada: borra la puntuación y lleva las letras latinas acentuadas
+# (á, ñ, ü, ç...) a su letra base en una sola pasada de str.translate
+_TABLA = {**_SIN_PUNTUACION, **{
+    cp: _normalizar_unicode(chr(cp)) for cp in range(0xC0, 0x250)
+    if _normalizar_unicode(chr(cp)) != chr(cp)
+}}
+
+
+def normalizar(t):
+    """Minúsculas, sin acentos ni puntuación: "Camisa Algodón!" -> "camisa algodon"."""
+    if not t: return ""
+    t = t.lower().strip().translate(_TABLA)
+    if t.isascii():
+        return t
+    # Quedan caracteres fuera de la tabla (otros alfabetos, acentos combinados)
+    return _normalizar_unicode(t)
+
+
+@lru_cache(maxsize=NORMALIZAR_MEMO)
+def normalizar_memo(t):
+    """normalizar con memoria LRU acotada, para textos que se repiten (categorías, nombres)."""
+    return normalizar(t)
+
+
+# ==========================================
+# BENCHMARK: normalizar actual vs la versión anterior
+# ==========================================
+# Uso: python normalizacion.py
+if __name__ == "__main__":
+    import random
+    import time
+
+    def normalizar_anterior(t):
+        if not t: return ""
+        t = t.lower().strip()
+        t = unicodedata.normalize("NFD", t)
+        t = "".join(c for c in t if not unicodedata.combining(c))
+        return t.translate(str.maketrans("", "", string.punctuation))
+
+    # Equivalencia: cada carácter del plano básico y textos mezclados al azar
+    for cp in range(0x10000):
+        if 0xD800 <= cp <= 0xDFFF:
+            continue
+        c = chr(cp)
+        assert normalizar(c) == normalizar_anterior(c), hex(cp)
+    muestra = "aeiouAEIOU áéíóúÁÉÍÓÚñÑüÜ¿?¡!.,-_ çḈ̃ Ωж漢 ".split(" ")
+    alfabeto = "".join(muestra) + " "
+    for _ in range(20000):
+        s = "".join(random.choice(alfabeto) for _ in range(random.randint(0, 30)))
+        assert normalizar(s) == normalizar_anterior(s), repr(s)
+
+    mensajes = ["hola", "Buenos días", "¿Tienen camisas blancas?", "ver carrito", "stock 12", "finalizar",
+                "Quiero una CHAMARRA de piel, ¿cuánto cuesta?", "catalogo", "Pantalón de mezclilla azul"]
+    catalogo = ([f"Camisa Algodón Orgánico {i}" for i in range(200)] + ["Pantalones", "Accesorios", "Niños y Niñas"]) * 50
+
+    def medir(nombre, fn, textos, repeticiones):
+        t = time.perf_counter()
+        for _ in range(repeticiones):
+            for s in textos:
+                fn(s)
+        total = repeticiones * len(textos)
+        print(f"{nombre:>28}: {total / (time.perf_counter() - t) / 1e6:.2f} M textos/s")
+
+    medir("anterior (mensajes)", normalizar_anterior, mensajes, 20000)
+    medir("normalizar (mensajes)", normalizar, mensajes, 20000)
+    medir("anterior (catálogo)", normalizar_anterior, catalogo, 20)
+    medir("normalizar (catálogo)", normalizar, catalogo, 20)
+    medir("normalizar_memo (catálogo)", normalizar_memo, catalogo, 20)
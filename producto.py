@@ -0,0 +1,175 @@
+# producto.py
+import sys
+import urllib.parse
+from urllib.parse import urlparse, parse_qs
+
+from normalizacion import normalizar, normalizar_memo
+
+
+def leer_precio(valor):
+    """Precio numérico a partir de 120, "120" o "$1,200.50"."""
+    if isinstance(valor, str):
+        try:
+            return float(valor.replace('$', '').replace(',', ''))
+        except ValueError:
+            return 0.0
+    try:
+        return float(valor or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def leer_stock(datos):
+    """El stock puede venir como número o como mapa {"Piezas": n}."""
+    stock = datos.get("stock", 0)
+    if isinstance(stock, dict):
+        stock = stock.get("Piezas", 0)
+    try:
+        return int(stock)
+    except (TypeError, ValueError):
+        return 0
+
+
+def clean_google_url(url):
+    if not url: return ""
+    clean = url.strip()
+    if "google." in clean and "imgurl=" in clean:
+        try:
+            parsed = urlparse(clean)
+            query_params = parse_qs(parsed.query)
+            if 'imgurl' in query_params:
+                return query_params['imgurl'][0]
+        except: pass
+    return clean
+
+
+def url_imagen_candidata(datos):
+    clean_url = clean_google_url(datos.get("imagen_url", ""))
+    if clean_url and clean_url.startswith("http") and len(clean_url) > 10:
+        return clean_url
+    return ""
+
+
+def _texto(valor):
+    return str(valor) if valor is not None else ""
+
+
+class Producto:
+    """
+    Registro inmutable de un producto, construido una vez al cargar el
+    documento de Firestore: precio y stock ya numéricos, textos de búsqueda
+    normalizados y URL de imagen ya limpia. Los manejadores lo comparten
+    entre usuarios sin copiarlo, así que no se puede modificar.
+    """
+
+    __slots__ = ("id", "nombre", "categoria", "descripcion", "precio", "stock", "oferta",
+                 "imagen_url", "norm_nombre", "norm_categoria", "norm_descripcion")
+
+    def __init__(self, **campos):
+        for campo in self.__slots__:
+            object.__setattr__(self, campo, campos[campo])
+
+    def __setattr__(self, campo, valor):
+        raise AttributeError("Producto es inmutable")
+
+    def __repr__(self):
+        return f"Producto({self.id!r}, {self.nombre!r})"
+
+    @classmethod
+    def desde_firestore(cls, pid, datos):
+        nombre = _texto(datos.get("nombre"))
+        # Las categorías se repiten en miles de productos: una sola copia de cada texto
+        categoria = sys.intern(_texto(datos.get("categoria")))
+        descripcion = _texto(datos.get("descripcion"))
+        return cls(
+            id=pid,
+            nombre=nombre,
+            categoria=categoria,
+            descripcion=descripcion,
+            precio=leer_precio(datos.get("precio")),
+            stock=leer_stock(datos),
+            oferta=bool(datos.get("oferta")),
+            imagen_url=url_imagen_candidata(datos),
+            norm_nombre=normalizar(nombre),
+            norm_categoria=sys.intern(normalizar_memo(categoria)),
+            norm_descripcion=normalizar(descripcion),
+        )
+
+    @property
+    def precio_texto(self):
+        """Precio para mostrar: 120 en lugar de 120.0."""
+        return str(int(self.precio)) if self.precio.is_integer() else f"{self.precio:.2f}"
+
+    @property
+    def imagen_respaldo(self):
+        """Imagen genérica con el nombre, para cuando la URL del producto no es válida."""
+        return f"https://placehold.co/300x300?text={urllib.parse.quote_plus(self.nombre or 'Producto')}"
+
+    @property
+    def disponible(self):
+        return self.stock > 0
+
+    def normalizado(self, campo):
+        """Texto normalizado de nombre, categoria o descripcion."""
+        return getattr(self, "norm_" + campo)
+
+    def a_dict(self):
+        return {"id": self.id, "nombre": self.nombre, "categoria": self.categoria, "descripcion": self.descripcion,
+                "precio": self.precio, "stock": self.stock, "oferta": self.oferta, "imagen_url": self.imagen_url}
+
+
+def productos_desde_firestore(datos):
+    """{pid: dict de Firestore} -> {pid: Producto}."""
+    return {pid: Producto.desde_firestore(pid, d) for pid, d in datos.items()}
+
+
+# ==========================================
+# BENCHMARK: memoria del catálogo con registros vs diccionarios
+# ==========================================
+# Uso: python producto.py [número de productos]
+if __name__ == "__main__":
+    import gc
+    import random
+    import time
+    import tracemalloc
+
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    categorias = ["Camisas", "Pantalones", "Vestidos", "Accesorios", "Calzado", "Niños y Niñas"]
+    palabras = "algodón lino mezclilla azul negro blanco manga larga corta slim casual formal talla".split()
+
+    def documento(i):
+        # Como llegan de Firestore: precios como texto o número, stock como número o mapa
+        return {
+            "nombre": f"{random.choice(palabras).title()} {random.choice(palabras)} {i}",
+            "categoria": random.choice(categorias),
+            "descripcion": " ".join(random.choices(palabras, k=12)),
+            "precio": random.choice([f"${random.randint(100, 2000)}", random.randint(100, 2000)]),
+            "stock": random.choice([random.randint(0, 50), {"Piezas": random.randint(0, 50)}]),
+            "oferta": random.random() < 0.1,
+            "imagen_url": f"https://cdn.ejemplo.com/productos/{i}.jpg",
+        }
+
+    def medir(nombre, construir):
+        gc.collect()
+        tracemalloc.start()
+        t = time.perf_counter()
+        catalogo = construir()
+        duracion = time.perf_counter() - t
+        actual, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{nombre:>32}: {actual / 2**20:7.1f} MiB ({actual / N:.0f} B/producto), {duracion:.2f} s")
+        return catalogo
+
+    random.seed(1)
+    crudos = {f"P{i}": documento(i) for i in range(N)}
+
+    def diccionarios():
+        # Caché anterior: el dict de Firestore más los textos normalizados guardados al lado
+        copia = {pid: dict(d) for pid, d in crudos.items()}
+        for d in copia.values():
+            d["_norm"] = {c: normalizar(str(d.get(c) or "")) for c in ("nombre", "categoria", "descripcion")}
+        return copia
+
+    print(f"Catálogo sintético de {N} productos")
+    medir("diccionarios (caché anterior)", diccionarios)
+    medir("registros Producto", lambda: productos_desde_firestore(crudos))
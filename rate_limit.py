@@ -0,0 +1,186 @@
+# rate_limit.py
+import threading
+import time
+from collections import OrderedDict
+
+# Segundos entre barridos de claves inactivas
+PURGA_INTERVALO = 30
+
+
+class _Cubeta:
+    __slots__ = ("tokens", "ts")
+
+    def __init__(self, tokens, ts):
+        self.tokens = tokens
+        self.ts = ts
+
+
+class LimitadorTasa:
+    """
+    Token bucket por clave, con un límite global opcional encima.
+    Cada clave ocupa memoria constante (dos números) y la comprobación es
+    O(1). Una cubeta que se rellenó por completo equivale a no tener
+    historial, así que esas claves se eliminan en los barridos periódicos.
+    """
+
+    def __init__(self, capacidad, ventana, capacidad_global=None, ventana_global=None, max_claves=100000):
+        self.capacidad = capacidad
+        self.tasa = capacidad / ventana
+        self.max_claves = max_claves
+        self._lock = threading.Lock()
+        self._cubetas = OrderedDict()  # clave -> _Cubeta, ordenadas por última actividad
+        self._global = None
+        if capacidad_global:
+            self._global = _Cubeta(capacidad_global, time.monotonic())
+            self.capacidad_global = capacidad_global
+            self.tasa_global = capacidad_global / (ventana_global or ventana)
+        self._ultima_purga = time.monotonic()
+        self._contadores = {"permitidos": 0, "rechazados": 0, "rechazados_global": 0, "purgadas": 0}
+
+    @staticmethod
+    def _rellenar(cubeta, capacidad, tasa, ahora):
+        cubeta.tokens = min(capacidad, cubeta.tokens + (ahora - cubeta.ts) * tasa)
+        cubeta.ts = ahora
+
+    def _intentar(self, clave, ahora):
+        # Se llama con el lock tomado; devuelve (permitido, segundos hasta el próximo token)
+        cubeta = self._cubetas.get(clave)
+        if cubeta is None:
+            cubeta = self._cubetas[clave] = _Cubeta(self.capacidad, ahora)
+        else:
+            self._rellenar(cubeta, self.capacidad, self.tasa, ahora)
+            self._cubetas.move_to_end(clave)
+        if cubeta.tokens < 1:
+            self._contadores["rechazados"] += 1
+            return False, (1 - cubeta.tokens) / self.tasa
+        if self._global is not None:
+            self._rellenar(self._global, self.capacidad_global, self.tasa_global, ahora)
+            if self._global.tokens < 1:
+                self._contadores["rechazados_global"] += 1
+                return False, (1 - self._global.tokens) / self.tasa_global
+            self._global.tokens -= 1
+        cubeta.tokens -= 1
+        self._contadores["permitidos"] += 1
+        return True, 0.0
+
+    def permitir(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            permitido, _ = self._intentar(clave, ahora)
+            self._purgar(ahora)
+        return permitido
+
+    def esperar(self, clave, timeout=None):
+        """Bloquea hasta obtener un token (pensado para el envío saliente)."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ahora = time.monotonic()
+            with self._lock:
+                permitido, espera = self._intentar(clave, ahora)
+                self._purgar(ahora)
+            if permitido:
+                return True
+            if limite is not None and ahora + espera > limite:
+                return False
+            time.sleep(espera)
+
+    def _purgar(self, ahora):
+        while len(self._cubetas) > self.max_claves:
+            self._cubetas.popitem(last=False)
+            self._contadores["purgadas"] += 1
+        if ahora - self._ultima_purga < PURGA_INTERVALO:
+            return
+        self._ultima_purga = ahora
+        lleno_en = self.capacidad / self.tasa
+        while self._cubetas:
+            clave, cubeta = next(iter(self._cubetas.items()))
+            if ahora - cubeta.ts < lleno_en:
+                break
+            self._cubetas.popitem(last=False)
+            self._contadores["purgadas"] += 1
+
+    def metricas(self):
+        with self._lock:
+            return {**self._contadores, "claves": len(self._cubetas)}
+
+
+# Token bucket atómico en Redis: un hash {t, ts} por clave con expiración. KEYS[2] (opcional)
+# es la cubeta global: se revisan las dos y solo se descuenta si ambas tienen token.
+# Devuelve 1 permitido, 0 rechazado por la clave, 2 rechazado por el límite global.
+_SCRIPT_REDIS = """
+local ahora = tonumber(ARGV[1])
+local function leer(clave, cap, tasa)
+    local b = redis.call('HMGET', clave, 't', 'ts')
+    local tokens = tonumber(b[1]) or cap
+    local ts = tonumber(b[2]) or ahora
+    return math.min(cap, tokens + math.max(0, ahora - ts) * tasa)
+end
+local function escribir(clave, tokens, cap, tasa)
+    redis.call('HSET', clave, 't', tokens, 'ts', ahora)
+    redis.call('EXPIRE', clave, math.ceil(cap / tasa) + 1)
+end
+local cap, tasa = tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = leer(KEYS[1], cap, tasa)
+local resultado = 1
+if tokens < 1 then
+    resultado = 0
+end
+local cap_g, tasa_g, tokens_g
+if KEYS[2] then
+    cap_g, tasa_g = tonumber(ARGV[4]), tonumber(ARGV[5])
+    tokens_g = leer(KEYS[2], cap_g, tasa_g)
+    if resultado == 1 and tokens_g < 1 then
+        resultado = 2
+    end
+end
+if resultado == 1 then
+    tokens = tokens - 1
+    if KEYS[2] then
+        tokens_g = tokens_g - 1
+    end
+end
+escribir(KEYS[1], tokens, cap, tasa)
+if KEYS[2] then
+    escribir(KEYS[2], tokens_g, cap_g, tasa_g)
+end
+return resultado
+"""
+
+
+class LimitadorTasaRedis:
+    """Mismo token bucket, compartido entre workers a través de Redis."""
+
+    def __init__(self, cliente, prefijo, capacidad, ventana, capacidad_global=None, ventana_global=None):
+        self.cliente = cliente
+        self.prefijo = prefijo
+        self.capacidad = capacidad
+        self.tasa = capacidad / ventana
+        self.capacidad_global = capacidad_global
+        self.tasa_global = capacidad_global / (ventana_global or ventana) if capacidad_global else None
+        self._script = cliente.register_script(_SCRIPT_REDIS)
+        self._lock = threading.Lock()
+        self._contadores = {"permitidos": 0, "rechazados": 0, "rechazados_global": 0}
+
+    def permitir(self, clave):
+        # Una sola llamada revisa la cubeta del usuario y la global antes de descontar de ninguna,
+        # igual que LimitadorTasa._intentar. El reloj de pared es el único que comparten varios servidores
+        keys, args = [f"{self.prefijo}:{clave}"], [time.time(), self.capacidad, self.tasa]
+        if self.capacidad_global:
+            keys.append(f"{self.prefijo}:__global__")
+            args += [self.capacidad_global, self.tasa_global]
+        resultado = ("rechazados", "permitidos", "rechazados_global")[int(self._script(keys=keys, args=args))]
+        with self._lock:
+            self._contadores[resultado] += 1
+        return resultado == "permitidos"
+
+    def esperar(self, clave, timeout=None):
+        limite = None if timeout is None else time.monotonic() + timeout
+        while not self.permitir(clave):
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(1 / self.tasa if self.tasa < 1 else 0.05)
+        return True
+
+    def metricas(self):
+        with self._lock:
+            return dict(self._contadores)
@@ -0,0 +1,112 @@
+# recuperacion.py
+import heapq
+import math
+import os
+
+# Configuración (variables de entorno)
+IA_CONTEXTO_K = int(os.environ.get("IA_CONTEXTO_K", 10))
+# Presupuesto aproximado de tokens para la lista de productos del prompt
+IA_CONTEXTO_TOKENS = int(os.environ.get("IA_CONTEXTO_TOKENS", 600))
+
+PESOS_CAMPOS = {"nombre": 3, "categoria": 2, "descripcion": 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Constante de Reciprocal Rank Fusion al combinar BM25 con la búsqueda semántica
+RRF_K = 60
+
+# La recuperación además descarta por longitud las de menos de 3 letras; las cortas
+# de aquí son para cache_respuestas, que conserva "m", "l", "no"...
+PALABRAS_VACIAS = {
+    "que", "los", "las", "del", "con", "para", "por", "una", "uno", "unos", "unas", "tienen", "tiene",
+    "hay", "cual", "cuales", "como", "cuanto", "cuesta", "precio", "quiero", "busco", "son", "mas",
+    "muy", "algo", "tienes", "el", "la", "lo", "un", "de", "al", "en", "a", "y", "o", "me", "te", "se",
+    "hola", "buenas", "buenos", "dias", "tardes", "noches", "porfa", "favor", "gracias",
+}
+
+
+def raiz(token):
+    """
+    Forma común de singular y plural en español: camisas -> camisa, aretes -> arete,
+    pantalones/pantalon -> pantalon, verdes/verde -> verd (no siempre es una palabra real).
+    """
+    if len(token) > 3 and token.endswith("s"):
+        token = token[:-1]
+    # La "e" de "-es" tras l, n, r, d o j se quita también en el singular para que coincidan
+    if len(token) >= 4 and token.endswith("e") and token[-2] in "lnrdj":
+        token = token[:-1]
+    return token
+
+
+def fragmento_producto(pid, p):
+    descripcion = p.descripcion or "Sin descripción"
+    return (f"- {p.nombre} (ID: {pid}) | Precio: ${p.precio_texto} | Stock: {p.stock} | "
+            f"Categoría: {p.categoria} | Descripción: {descripcion}")
+
+
+class RecuperadorContexto:
+    """
+    Etapa de recuperación para el prompt de la IA, construida una vez por
+    versión del catálogo: guarda el fragmento de texto ya formateado de cada
+    producto y un índice BM25 (con pesos por campo) sobre nombre, categoría y
+    descripción. Cada consulta solo toca los productos que comparten alguna
+    palabra con la pregunta.
+    """
+
+    def __init__(self, productos, normalizar):
+        self.productos = productos
+        self.normalizar = normalizar
+        self.fragmentos = {}
+        self._postings = {}  # raíz -> [(pid, tf ponderada)]
+        self._longitud = {}
+        for pid, p in productos.items():
+            frecuencias = {}
+            for campo, peso in PESOS_CAMPOS.items():
+                for token in p.normalizado(campo).split():
+                    r = raiz(token)
+                    frecuencias[r] = frecuencias.get(r, 0) + peso
+            for r, tf in frecuencias.items():
+                self._postings.setdefault(r, []).append((pid, tf))
+            self._longitud[pid] = sum(frecuencias.values())
+            self.fragmentos[pid] = fragmento_producto(pid, p)
+        n = len(productos)
+        self._promedio = (sum(self._longitud.values()) / n) if n else 0.0
+        self._idf = {r: math.log(1 + (n - len(ps) + 0.5) / (len(ps) + 0.5)) for r, ps in self._postings.items()}
+
+    def puntuar(self, consulta):
+        """{pid: puntaje BM25} de los productos que comparten alguna palabra con la consulta."""
+        puntajes = {}
+        for token in set(self.normalizar(consulta).split()):
+            if token in PALABRAS_VACIAS or len(token) < 3:
+                continue
+            r = raiz(token)
+            idf = self._idf.get(r)
+            if idf is None:
+                continue
+            for pid, tf in self._postings[r]:
+                norma = BM25_K1 * (1 - BM25_B + BM25_B * self._longitud[pid] / self._promedio)
+                puntajes[pid] = puntajes.get(pid, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norma)
+        return puntajes
+
+    def recuperar(self, consulta, k=IA_CONTEXTO_K, presupuesto=IA_CONTEXTO_TOKENS, semanticos=None):
+        """
+        Top-k IDs por relevancia cuyo texto cabe en el presupuesto de tokens
+        (~4 caracteres por token). Si se pasa el ranking de la búsqueda
+        semántica, se combina con el de BM25 por Reciprocal Rank Fusion.
+        """
+        puntajes = self.puntuar(consulta)
+        ranking = heapq.nlargest(k, puntajes, key=puntajes.get)
+        if semanticos:
+            fusion = {}
+            for lista in (ranking, [pid for pid in semanticos if pid in self.fragmentos]):
+                for pos, pid in enumerate(lista):
+                    fusion[pid] = fusion.get(pid, 0.0) + 1.0 / (RRF_K + pos + 1)
+            ranking = heapq.nlargest(k, fusion, key=fusion.get)
+        ids = []
+        usados = 0
+        for pid in ranking:
+            costo = len(self.fragmentos[pid]) // 4 + 1
+            if ids and usados + costo > presupuesto:
+                break
+            ids.append(pid)
+            usados += costo
+        return ids
@@ -0,0 +1,221 @@
+# router.py
+"""
+Clasificador de intenciones del bot.
+
+Las reglas se declaran en orden de prioridad (la primera que aplica gana,
+como en la cadena de ifs original) y se compilan una sola vez:
+
+- todas las palabras clave van a un trie, y un solo recorrido del mensaje
+  encuentra cuáles aparecen y si aparecen al inicio o como mensaje completo;
+- por cada estado de la conversación se arma una tabla palabra -> reglas
+  aplicables, así que clasificar no depende de cuántos comandos existan
+  sino de las pocas palabras que aparecen en el mensaje.
+
+Tipos de regla:
+    "igual"     el mensaje es exactamente una de las palabras
+    "prefijo"   el mensaje empieza con una de las palabras
+    "contiene"  alguna de las palabras aparece en el mensaje
+    "todas"     todas las palabras aparecen en el mensaje
+    "siempre"   aplica a cualquier mensaje (flujos que capturan la respuesta)
+    "funcion"   predicado funcion(msg); si devuelve algo distinto de None/False
+                ese valor se entrega al manejador como dato
+"""
+import re
+
+_IGUAL, _PREFIJO, _CONTIENE = 1, 2, 4
+_TIPOS_PALABRA = {"igual": _IGUAL, "prefijo": _PREFIJO, "contiene": _CONTIENE}
+
+
+class Regla:
+    __slots__ = ("intencion", "tipo", "palabras", "estados", "funcion", "prioridad")
+
+    def __init__(self, intencion, tipo, palabras=(), estados=None, funcion=None):
+        if tipo not in _TIPOS_PALABRA and tipo not in ("todas", "siempre", "funcion"):
+            raise ValueError(f"Tipo de regla desconocido: {tipo}")
+        self.intencion = intencion
+        self.tipo = tipo
+        self.palabras = tuple(palabras)
+        self.estados = frozenset(estados) if estados else None
+        self.funcion = funcion
+        self.prioridad = 0
+
+
+class Router:
+    def __init__(self, reglas):
+        self.reglas = list(reglas)
+        self._trie = {}
+        estados = set()
+        for prioridad, regla in enumerate(self.reglas):
+            regla.prioridad = prioridad
+            if regla.estados:
+                estados |= regla.estados
+            for palabra in regla.palabras:
+                nodo = self._trie
+                for c in palabra:
+                    nodo = nodo.setdefault(c, {})
+                nodo[None] = palabra  # Fin de palabra
+        # Tabla de despacho por estado; None = estados sin reglas propias
+        self._tablas = {estado: self._compilar(estado) for estado in estados}
+        self._tablas[None] = self._compilar(None)
+
+    def _compilar(self, estado):
+        por_palabra, especiales = {}, []
+        for regla in self.reglas:
+            if regla.estados is not None and estado not in regla.estados:
+                continue
+            if regla.tipo in _TIPOS_PALABRA:
+                bit = _TIPOS_PALABRA[regla.tipo]
+                for palabra in regla.palabras:
+                    por_palabra.setdefault(palabra, []).append((bit, regla))
+            else:
+                especiales.append(regla)
+        return por_palabra, especiales
+
+    def _coincidencias(self, msg):
+        """{palabra: bits} con cómo aparece cada palabra clave en el mensaje (un solo recorrido)."""
+        encontradas = {}
+        n = len(msg)
+        for i in range(n):
+            nodo = self._trie
+            j = i
+            while j < n:
+                nodo = nodo.get(msg[j])
+                if nodo is None:
+                    break
+                j += 1
+                palabra = nodo.get(None)
+                if palabra is not None:
+                    bits = _CONTIENE
+                    if i == 0:
+                        bits |= _PREFIJO | (_IGUAL if j == n else 0)
+                    encontradas[palabra] = encontradas.get(palabra, 0) | bits
+        return encontradas
+
+    def clasificar(self, msg, estado=None):
+        """Devuelve (intención, dato) de la regla de mayor prioridad que aplica, o (None, None)."""
+        por_palabra, especiales = self._tablas.get(estado) or self._tablas[None]
+        encontradas = self._coincidencias(msg)
+        mejor = None
+        for palabra, bits in encontradas.items():
+            for bit, regla in por_palabra.get(palabra, ()):
+                if bits & bit and (mejor is None or regla.prioridad < mejor.prioridad):
+                    mejor = regla
+        # Las reglas especiales solo se evalúan si pueden ganarle a la encontrada
+        for regla in especiales:
+            if mejor is not None and regla.prioridad > mejor.prioridad:
+                break
+            if regla.tipo == "siempre":
+                return regla.intencion, None
+            if regla.tipo == "todas":
+                if all(p in encontradas for p in regla.palabras):
+                    return regla.intencion, None
+                continue
+            dato = regla.funcion(msg)
+            if dato is not None and dato is not False:
+                return regla.intencion, dato
+        if mejor is not None:
+            return mejor.intencion, None
+        return None, None
+
+
+_ID_PRODUCTO = re.compile(r"\d+")
+
+
+def id_en_pedido(msg):
+    """ID de producto en "pedido 15" o en un mensaje que solo es el número (hasta 4 dígitos)."""
+    if msg.startswith("pedido") or (msg.isdigit() and len(msg) <= 4):
+        m = _ID_PRODUCTO.search(msg)
+        return m.group(0) if m else None
+    return None
+
+
+def reglas_bot(detectar_categoria):
+    """Reglas del bot en orden de prioridad; detectar_categoria(msg) devuelve la categoría o None."""
+    registro = ("reg_nombre", "reg_tel", "reg_dir")
+    return [
+        Regla("cancelar", "igual", ["cancelar"]),
+        # Flujos activos: capturan la respuesta salvo para cambiar de flujo
+        Regla("login", "contiene", ["entrar", "login"], estados=registro),
+        Regla("reg_nombre", "siempre", estados=["reg_nombre"]),
+        Regla("reg_tel", "siempre", estados=["reg_tel"]),
+        Regla("reg_dir", "siempre", estados=["reg_dir"]),
+        Regla("registrar", "contiene", ["registrar", "crear cuenta"]),
+        Regla("login_telefono", "siempre", estados=["login"]),
+        Regla("login", "prefijo", ["iniciar"]),
+        Regla("login", "contiene", ["entrar", "login"]),
+        # Comandos generales
+        Regla("saludo", "contiene", ["hola", "inicio", "menu", "buenos dias", "buenas tardes"]),
+        Regla("contacto", "contiene", ["contacto"]),
+        Regla("novedades", "contiene", ["nuevo", "novedad", "oferta"]),
+        Regla("buscar", "prefijo", ["buscar"]),
+        Regla("stock", "prefijo", ["stock"]),
+        Regla("ver_carrito", "todas", ["carrito", "ver"]),
+        Regla("vaciar", "contiene", ["vaciar"]),
+        Regla("historial", "contiene", ["mis pedidos", "historial"]),
+        Regla("mas_pedidos", "contiene", ["mas pedidos"]),
+        Regla("mi_pedido", "contiene", ["mi pedido"]),
+        Regla("catalogo", "contiene", ["catalogo"]),
+        Regla("categoria", "funcion", funcion=detectar_categoria),
+        # Navegación dentro de una categoría
+        Regla("siguiente", "igual", ["no", "siguiente", "otro"], estados=["viendo_cat"]),
+        Regla("agregar", "igual", ["si", "lo quiero", "agregar"], estados=["viendo_cat"]),
+        Regla("salir", "igual", ["salir"], estados=["viendo_cat"]),
+        Regla("pedido_id", "funcion", funcion=id_en_pedido),
+        Regla("finalizar", "contiene", ["finalizar", "comprar"]),
+    ]
+
+
+# ==========================================
+# BENCHMARK: router compilado vs cadena de comprobaciones
+# ==========================================
+# Uso: python router.py [archivo con un mensaje por línea]
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as f:
+            corpus = [(linea.strip(), None) for linea in f if linea.strip()]
+    else:
+        corpus = [
+            ("hola", None), ("buenos dias", None), ("catalogo", "logueado"), ("camisas", "logueado"),
+            ("si", "viendo_cat"), ("no", "viendo_cat"), ("siguiente", "viendo_cat"), ("salir", "viendo_cat"),
+            ("buscar pantalon negro", None), ("stock 12", None), ("ver carrito", "logueado"),
+            ("pedido 15", "logueado"), ("15", "logueado"), ("finalizar", "logueado"), ("mi pedido", "logueado"),
+            ("tienen camisas blancas de manga larga para hombre", None), ("cuanto cuesta el envio a monterrey", None),
+            ("Juan Perez", "reg_nombre"), ("5512345678", "reg_tel"), ("5512345678", "login"),
+            ("ofertas", None), ("contacto", None), ("cancelar", "viendo_cat"), ("registrar", None),
+        ]
+
+    categorias = {"camisas", "pantalones", "vestidos", "accesorios"}
+    router = Router(reglas_bot(lambda msg: msg if msg in categorias else None))
+
+    def cadena(msg, estado):
+        # Equivalente a la cadena de ifs: cada regla se comprueba por separado en orden
+        for r in router.reglas:
+            if r.estados is not None and estado not in r.estados:
+                continue
+            if ((r.tipo == "igual" and msg in r.palabras)
+                    or (r.tipo == "prefijo" and any(msg.startswith(p) for p in r.palabras))
+                    or (r.tipo == "contiene" and any(p in msg for p in r.palabras))
+                    or (r.tipo == "todas" and all(p in msg for p in r.palabras))
+                    or r.tipo == "siempre"):
+                return r.intencion, None
+            if r.tipo == "funcion":
+                dato = r.funcion(msg)
+                if dato is not None and dato is not False:
+                    return r.intencion, dato
+        return None, None
+
+    distintos = [(m, e) for m, e in corpus if router.clasificar(m, e) != cadena(m, e)]
+    if distintos:
+        print(f"⚠️ Clasificación distinta en: {distintos}")
+
+    REPETICIONES = 20000 // len(corpus) + 1
+    for nombre, fn in (("router", router.clasificar), ("cadena", cadena)):
+        t = time.perf_counter()
+        for _ in range(REPETICIONES):
+            for msg, estado in corpus:
+                fn(msg, estado)
+        total = REPETICIONES * len(corpus)
+        print(f"{nombre:>7}: {1e6 * (time.perf_counter() - t) / total:.2f} µs/mensaje ({total} mensajes)")
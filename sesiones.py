@@ -0,0 +1,141 @@
+# sesiones.py
+import os
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from conexion_firebase import db
+
+# Configuración (variables de entorno)
+SESIONES_INTERVALO = float(os.environ.get("SESIONES_INTERVALO", 5))
+SESIONES_LOTE = min(500, int(os.environ.get("SESIONES_LOTE", 400)))  # Firestore admite 500 escrituras por lote
+SESIONES_MAX_HUELLAS = int(os.environ.get("SESIONES_MAX_HUELLAS", 10000))
+
+
+def compactar(estado):
+    """Copia de la sesión sin la marca de tiempo (que cambia siempre) ni copias de productos."""
+    return {k: v for k, v in estado.items() if k not in ("prods_cat", "ultima_actividad")}
+
+
+def _huella(compacto):
+    return hash(json.dumps(compacto, sort_keys=True, default=str))
+
+
+class PersistenciaSesiones:
+    """
+    Persistencia write-behind de las sesiones en Firestore.
+    Cada mensaje solo marca la sesión como sucia (si de verdad cambió); un
+    hilo en segundo plano escribe en lotes la última versión de cada
+    remitente cada SESIONES_INTERVALO segundos y al apagar el proceso.
+    """
+
+    def __init__(self, coleccion="sesiones", intervalo=SESIONES_INTERVALO, lote=SESIONES_LOTE):
+        self.coleccion = coleccion
+        self.intervalo = intervalo
+        self.lote = lote
+        self._lock = threading.Lock()
+        self._sucias = {}   # sender_id -> sesión compacta pendiente de escribir
+        self._huellas = OrderedDict()  # sender_id -> huella de la última versión marcada (LRU)
+        self._detener = threading.Event()
+        self._hilo = None
+        self._pid = None
+        self._contadores = {"marcadas": 0, "sin_cambios": 0, "escritas": 0, "lotes": 0, "errores": 0}
+
+    def _iniciar(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="sesiones-flush", daemon=True)
+            self._hilo.start()
+            self._pid = os.getpid()
+
+    # --- API usada por el bot ---
+    def cargar(self, sender_id):
+        with self._lock:
+            pendiente = self._sucias.get(sender_id)
+        if pendiente is not None:
+            return dict(pendiente)
+        try:
+            doc = db.collection(self.coleccion).document(sender_id).get()
+            if not doc.exists:
+                return None
+            s = doc.to_dict()
+            s.pop("ultima_actividad", None)
+            with self._lock:
+                self._recordar_huella(sender_id, _huella(s))
+            return s
+        except Exception as e:
+            print(f"🔥 Error cargando sesión {sender_id}: {type(e).__name__} - {e}")
+            return None
+
+    def marcar(self, sender_id, estado):
+        """Registra la versión actual de la sesión; las escrituras se agrupan por remitente."""
+        if not estado:
+            return False
+        self._iniciar()
+        compacto = compactar(estado)
+        h = _huella(compacto)
+        with self._lock:
+            if self._huellas.get(sender_id) == h:
+                self._contadores["sin_cambios"] += 1
+                return False
+            self._recordar_huella(sender_id, h)
+            self._sucias[sender_id] = compacto
+            self._contadores["marcadas"] += 1
+        return True
+
+    def _recordar_huella(self, sender_id, h):
+        # Olvidar una huella solo cuesta una escritura extra la próxima vez
+        self._huellas[sender_id] = h
+        self._huellas.move_to_end(sender_id)
+        while len(self._huellas) > SESIONES_MAX_HUELLAS:
+            self._huellas.popitem(last=False)
+
+    def olvidar(self, sender_id):
+        """Suelta la huella de una sesión desalojada de la RAM (la escritura pendiente se conserva)."""
+        with self._lock:
+            self._huellas.pop(sender_id, None)
+
+    # --- Escritura en lotes ---
+    def vaciar(self):
+        with self._lock:
+            pendientes, self._sucias = self._sucias, {}
+        items = list(pendientes.items())
+        for i in range(0, len(items), self.lote):
+            grupo = items[i:i + self.lote]
+            try:
+                batch = db.batch()
+                ahora = datetime.now()
+                for sender_id, compacto in grupo:
+                    batch.set(db.collection(self.coleccion).document(sender_id),
+                              {**compacto, "ultima_actividad": ahora})
+                batch.commit()
+                with self._lock:
+                    self._contadores["escritas"] += len(grupo)
+                    self._contadores["lotes"] += 1
+            except Exception as e:
+                print(f"🔥 Error guardando sesiones: {type(e).__name__} - {e}")
+                with self._lock:
+                    self._contadores["errores"] += 1
+                    # Se reintenta en el siguiente ciclo salvo que ya haya una versión más nueva
+                    for sender_id, compacto in grupo:
+                        self._sucias.setdefault(sender_id, compacto)
+        return len(items)
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            self.vaciar()
+
+    def detener(self):
+        if self._pid != os.getpid():
+            return
+        self._detener.set()
+        self._hilo.join(self.intervalo)
+        self.vaciar()
+        self._pid = None
+
+    def metricas(self):
+        with self._lock:
+            return {**self._contadores, "pendientes": len(self._sucias)}
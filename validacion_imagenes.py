@@ -0,0 +1,113 @@
+# validacion_imagenes.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Configuración (variables de entorno)
+IMG_TTL_VALIDA = int(os.environ.get("IMG_TTL_VALIDA", 6 * 3600))
+IMG_TTL_INVALIDA = int(os.environ.get("IMG_TTL_INVALIDA", 600))
+IMG_PROBADORES = int(os.environ.get("IMG_PROBADORES", 4))
+IMG_MAX_URLS = int(os.environ.get("IMG_MAX_URLS", 50000))
+IMG_TIMEOUT = float(os.environ.get("IMG_TIMEOUT", 2))
+
+
+class ValidadorImagenes:
+    """
+    Caché de URLs de imagen ya verificadas, alimentada por un probador en
+    segundo plano. El camino de una petición nunca hace un HEAD: si la URL no
+    se conoce todavía se programa su verificación y se responde "no válida"
+    para que se use el placeholder al instante.
+    """
+
+    def __init__(self, ttl_valida=IMG_TTL_VALIDA, ttl_invalida=IMG_TTL_INVALIDA,
+                 probadores=IMG_PROBADORES, max_urls=IMG_MAX_URLS, timeout=IMG_TIMEOUT):
+        self.ttl_valida = ttl_valida
+        self.ttl_invalida = ttl_invalida
+        self.probadores = max(1, probadores)
+        self.max_urls = max_urls
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # url -> (valida, expira_en)
+        self._en_curso = set()
+        self._pid = None
+        self._pool = None
+        self._session = None
+        self._contadores = {"aciertos": 0, "desconocidas": 0, "probadas": 0, "invalidas": 0}
+
+    def _iniciar(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.probadores, thread_name_prefix="img-probe")
+            self._session = requests.Session()
+            self._session.headers["User-Agent"] = "Mozilla/5.0 (compatible; Bot/1.0)"
+            self._en_curso = set()
+            self._pid = os.getpid()
+
+    # --- Camino de la petición (sin red) ---
+    def es_valida(self, url):
+        if not url: return False
+        with self._lock:
+            entrada = self._cache.get(url)
+            self._contadores["aciertos" if entrada else "desconocidas"] += 1
+        if entrada is None:
+            self.programar([url])
+            return False
+        valida, expira_en = entrada
+        if time.monotonic() >= expira_en:
+            # Se sigue usando el último resultado mientras se vuelve a comprobar
+            self.programar([url])
+        return valida
+
+    # --- Probador en segundo plano ---
+    def programar(self, urls):
+        """Programa la verificación de las URLs desconocidas o vencidas."""
+        self._iniciar()
+        ahora = time.monotonic()
+        pendientes = []
+        with self._lock:
+            for url in urls:
+                if not url or url in self._en_curso: continue
+                entrada = self._cache.get(url)
+                if entrada is not None and ahora < entrada[1]: continue
+                self._en_curso.add(url)
+                pendientes.append(url)
+        for url in pendientes:
+            self._pool.submit(self._probar, url)
+        return len(pendientes)
+
+    def _probar(self, url):
+        try:
+            r = self._session.head(url, allow_redirects=True, timeout=self.timeout)
+            valida = r.status_code == 200 and 'image' in r.headers.get('Content-Type', '')
+        except Exception:
+            valida = False
+        ttl = self.ttl_valida if valida else self.ttl_invalida
+        with self._lock:
+            self._cache[url] = (valida, time.monotonic() + ttl)
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.max_urls:
+                self._cache.popitem(last=False)
+            self._en_curso.discard(url)
+            self._contadores["probadas"] += 1
+            if not valida:
+                self._contadores["invalidas"] += 1
+
+    def esperar(self, timeout):
+        """Espera a que terminen las verificaciones en curso (o a que pase timeout). True si terminaron."""
+        limite = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._en_curso:
+                    return True
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(0.05)
+
+    def metricas(self):
+        with self._lock:
+            return {**self._contadores, "en_cache": len(self._cache), "en_curso": len(self._en_curso)}